@@ -0,0 +1,206 @@
+import snapshot
+
+
+def get_artist_key(artist_id):
+
+    """
+    Return the integer key of an artist ID given as str, other IDs unchanged
+    """
+
+    if isinstance(artist_id, str):
+        try:
+            return int(artist_id)
+        except ValueError:
+            pass
+    return artist_id
+
+
+class ArtistDatabase(dict):
+
+    """
+    Artist database keyed by integer artist IDs
+    Kept compatible with callers still looking artists up with str(id),
+    through [], get and in alike
+    """
+
+    def __missing__(self, artist_id):
+        key = get_artist_key(artist_id)
+        if key is artist_id or not dict.__contains__(self, key):
+            raise KeyError(artist_id)
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, artist_id):
+        return dict.__contains__(self, get_artist_key(artist_id))
+
+    def get(self, artist_id, default=None):
+        return dict.get(self, get_artist_key(artist_id), default)
+
+
+def extract_line_up_database():
+
+    """
+    Return the flattened line ups of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["line_up_database"]
+
+
+def build_line_up_database(artist_database):
+
+    """
+    Flatten once every line up of every group
+    (group_id, line_up) -> {"bottom", "top", "bottom_set", "top_set"}
+    bottom only keeps the lowest tier artists, top keeps the subgroups as well
+    """
+
+    line_up_database = {}
+
+    def flatten(group_id, line_up):
+
+        if (group_id, line_up) in line_up_database:
+            return line_up_database[(group_id, line_up)]
+
+        bottom = []
+        top = []
+        for member_id, member_line_up in artist_database[group_id]["members"][line_up]:
+            top.append(member_id)
+            if member_line_up == -1:
+                bottom.append(member_id)
+            else:
+                member_flat = flatten(member_id, member_line_up)
+                bottom += member_flat["bottom"]
+                top += member_flat["top"]
+
+        line_up_database[(group_id, line_up)] = {
+            "bottom": tuple(bottom),
+            "top": tuple(top),
+            "bottom_set": frozenset(bottom),
+            "top_set": frozenset(top),
+        }
+        return line_up_database[(group_id, line_up)]
+
+    for artist_id, artist in artist_database.items():
+        for line_up in range(len(artist["members"])):
+            flatten(artist_id, line_up)
+
+    return line_up_database
+
+
+def get_line_up_members(artist_id, line_up, bottom=True, line_up_database=None):
+
+    """
+    Return the flattened members of a line up, repetitions included
+    A -1 line up is the artist alone
+    """
+
+    if line_up == -1:
+        return (int(artist_id),)
+
+    if line_up_database is None:
+        line_up_database = extract_line_up_database()
+
+    return line_up_database[(int(artist_id), line_up)]["bottom" if bottom else "top"]
+
+
+def get_line_up_member_set(artist_id, line_up, bottom=True):
+
+    """
+    Return the flattened members of a line up as a frozenset
+    A -1 line up is the artist alone
+    """
+
+    if line_up == -1:
+        return frozenset([int(artist_id)])
+
+    return extract_line_up_database()[(int(artist_id), line_up)][
+        "bottom_set" if bottom else "top_set"
+    ]
+
+
+# int.bit_count is only available from python 3.10
+popcount = getattr(int, "bit_count", lambda mask: bin(mask).count("1"))
+
+
+def extract_artist_bits():
+
+    """
+    Return the artist bits of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["artist_bits"]
+
+
+def build_artist_bits(artist_database, store, line_up_database):
+
+    """
+    Give every artist a dense integer id, used as its bit in artist masks
+    The most credited artists get the lowest bits to keep the masks small
+    """
+
+    credits = {artist_id: 0 for artist_id in artist_database}
+    for artists, line_ups in zip(
+        store.get_column("artists"), store.get_column("artists_line_up")
+    ):
+        if not artists:
+            continue
+        for artist, line_up in zip(artists.split(","), line_ups.split(",")):
+            for member in get_line_up_members(
+                artist, int(line_up), line_up_database=line_up_database
+            ):
+                credits[member] += 1
+
+    return {
+        artist_id: bit
+        for bit, artist_id in enumerate(
+            sorted(credits, key=lambda artist_id: -credits[artist_id])
+        )
+    }
+
+
+def get_artists_mask(artist_ids, artist_bits=None):
+
+    """
+    Return the mask of a list of artist IDs
+    """
+
+    if artist_bits is None:
+        artist_bits = extract_artist_bits()
+
+    mask = 0
+    for artist_id in artist_ids:
+        mask |= 1 << artist_bits[int(artist_id)]
+    return mask
+
+
+def extract_line_up_masks():
+
+    """
+    Return the line up masks of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["line_up_masks"]
+
+
+def build_line_up_masks(line_up_database, artist_bits):
+
+    """
+    Compute the mask of the bottom members of every line up of every group
+    """
+
+    return {
+        group_line_up: get_artists_mask(members["bottom_set"], artist_bits)
+        for group_line_up, members in line_up_database.items()
+    }
+
+
+def get_line_up_mask(artist_id, line_up):
+
+    """
+    Return the mask of the bottom members of a line up
+    A -1 line up is the artist alone
+    """
+
+    if line_up == -1:
+        return 1 << extract_artist_bits()[int(artist_id)]
+
+    return extract_line_up_masks()[(int(artist_id), line_up)]
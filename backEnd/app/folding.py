@@ -0,0 +1,211 @@
+"""
+Reduce names and searches to canonical folded forms so that searching is
+a plain substring test (partial match) or string equality (exact match)
+
+Names and searches are kept both with only their characters folded and with their sequences
+(ou, oo, ...) folded too, so that a partial search starting or ending inside a folded sequence
+still matches, and a search matches if any of its forms is found in any form of the name
+
+Characters having several spellings (× as x or as a separator, æ as ae, a or e, ...) are folded
+to one of them, names holding them are also kept with the others (FOLD_ALTERNATIVE_RULES)
+so that any of the spellings finds them, searches are only folded to the first one
+
+Unlike the former regex rules, folding applies to names as well as to searches: a name
+written with a variant ("Dŏ", "√") is found by its plain spelling, and a search written with
+a variant finds names written plainly, both ways alike
+
+Also used by the process_data_scripts so that both sides fold the same way
+"""
+
+import re, itertools
+from functools import lru_cache
+
+# Every character of input is replaced by replace
+FOLD_CHARACTER_RULES = [
+    {"input": "źŹ", "replace": "z"},
+    {"input": "ļĻ˥", "replace": "l"},
+    {"input": "ōóòöôøӨөΦφο", "replace": "o"},
+    {"input": "ūûúùüǖμ", "replace": "u"},
+    {"input": "@äάâàáạåā∀Λλ", "replace": "a"},
+    {"input": "æ", "replace": "ae"},
+    {"input": "č℃", "replace": "c"},
+    {"input": "əéêёëèē", "replace": "e"},
+    {"input": "ñ", "replace": "n"},
+    {"input": "²", "replace": "2"},
+    {"input": "³", "replace": "3"},
+    {"input": "íίɪ", "replace": "i"},
+    {"input": "×", "replace": "x"},
+    {"input": "ßβ", "replace": "b"},
+    {"input": "Яя", "replace": "r"},
+    {"input": "ς", "replace": "s"},
+    {"input": "’ˈ", "replace": "'"},
+    {"input": "✻＊", "replace": "*"},
+    {
+        "input": "★☆/♣=+·♥♡∽・◎±⇔≒〜†♪→␣:∞;~-?,.!_",
+        "replace": " ",
+    },
+]
+
+# Other spellings of characters, names holding them also get a form with each of them
+FOLD_ALTERNATIVE_RULES = [
+    {"input": "Өө", "replace": ["0"]},
+    {"input": "×", "replace": [" "]},
+    {"input": "@", "replace": [" "]},
+    {"input": "æ", "replace": ["a", "e"]},
+    {"input": "'’ˈ", "replace": [" "]},
+    {"input": "*✻＊", "replace": [" "]},
+]
+
+# Applied after the character rules until none of them match anymore
+FOLD_SEQUENCE_RULES = [
+    {"input": "ou", "replace": "o"},
+    {"input": "oo", "replace": "o"},
+    {"input": "oh", "replace": "o"},
+    {"input": "wo", "replace": "o"},
+    {"input": "uu", "replace": "u"},
+    {"input": "aa", "replace": "a"},
+]
+
+FOLD_TRANSLATION_TABLE = str.maketrans(
+    {char: rule["replace"] for rule in FOLD_CHARACTER_RULES for char in rule["input"]}
+)
+
+
+MULTIPLE_SPACES = re.compile(" {2,}")
+
+
+def fold_characters(name):
+
+    """
+    Return a name or a search with only its characters folded
+    """
+
+    if not name:
+        return ""
+
+    return MULTIPLE_SPACES.sub(" ", name.lower().translate(FOLD_TRANSLATION_TABLE))
+
+
+def fold(name):
+
+    """
+    Return the canonical folded form of a name or a search, characters and sequences folded
+    """
+
+    name = fold_characters(name)
+
+    previous_name = None
+    while previous_name != name:
+        previous_name = name
+        for rule in FOLD_SEQUENCE_RULES:
+            name = name.replace(rule["input"], rule["replace"])
+
+    return name
+
+
+def get_folded_forms(name):
+
+    """
+    Return the folded forms a name can be found by
+    """
+
+    names = [name]
+    for rule in FOLD_ALTERNATIVE_RULES:
+        if not any(char in name for char in rule["input"]):
+            continue
+        names += [
+            alternative_name.translate(
+                str.maketrans(dict.fromkeys(rule["input"], replace))
+            )
+            for alternative_name in names
+            for replace in rule["replace"]
+        ]
+
+    forms = []
+    for name in names:
+        for form in [fold_characters(name), fold(name)]:
+            if form not in forms:
+                forms.append(form)
+
+    return forms
+
+
+def get_search_terms(search, swap_words=False):
+
+    """
+    Return the folded searches to look for
+    If swap_words, a two words search is also looked for in reverse order
+    """
+
+    searches = [search]
+
+    if swap_words:
+        words = search.lower().split(" ")
+        if len(words) == 2:
+            searches.append(" ".join([words[1], words[0]]))
+
+    terms = []
+    for search in searches:
+        for term in [fold_characters(search), fold(search)]:
+            if term not in terms:
+                terms.append(term)
+
+    return terms
+
+
+def get_trigrams(folded_name):
+
+    """
+    Return the set of trigrams of a folded name
+    """
+
+    return {folded_name[i : i + 3] for i in range(len(folded_name) - 2)}
+
+
+@lru_cache(maxsize=1024)
+def compile_search(search, partial_match=True, swap_words=False):
+
+    """
+    Fold a search once and keep everything matching needs
+    Hits and misses can be read with compile_search.cache_info()
+    """
+
+    terms = tuple(get_search_terms(search, swap_words))
+
+    return {
+        "terms": terms,
+        "partial_match": partial_match,
+        "trigrams": tuple(get_trigrams(term) for term in terms),
+    }
+
+
+def match(folded_name, terms, partial_match=True):
+
+    """
+    Check if an already folded form of a name matches one of the folded search terms
+    """
+
+    if partial_match:
+        return any(term in folded_name for term in terms)
+    return folded_name in terms
+
+
+def get_match_rank(folded_name, terms, partial_match=True):
+
+    """
+    Rank how well an already folded form of a name matches the folded search terms,
+    0 if it is one of them, 1 if one is a whole word sequence of it, 2 for any other substring,
+    None if it doesn't match
+    """
+
+    if folded_name in terms:
+        return 0
+    if not partial_match:
+        return None
+
+    padded_name = f" {folded_name} "
+    if any(f" {term.strip()} " in padded_name for term in terms):
+        return 1
+    if any(term in folded_name for term in terms):
+        return 2
+    return None
@@ -1,8 +1,63 @@
-import utils, sql_calls
+import sql_calls, search_index, folding, artist_graph, result_cache, snapshot
+import pagination
 from datetime import datetime
-import timeit
+import timeit, itertools
 from datetime import datetime
-import re
+from functools import wraps
+from contextvars import ContextVar
+
+# Sub-results shared by the searches of a batch, None outside of a batch
+batch_memo = ContextVar("batch_memo", default=None)
+
+
+def memoize_in_batch(function):
+
+    """
+    Compute the decorated function once per arguments for all the searches of a batch
+    Its results are shared and must not be modified
+    """
+
+    @wraps(function)
+    def wrapper(*args):
+
+        memo = batch_memo.get()
+        if memo is None:
+            return function(*args)
+
+        key = (function.__name__, args)
+        if key not in memo:
+            memo[key] = function(*args)
+        return memo[key]
+
+    return wrapper
+
+
+@memoize_in_batch
+def find_artist_ids(search, partial_match):
+
+    """
+    Return the IDs of the 50 artists whose names match the search best
+    """
+
+    return search_index.get_matching_keys(
+        search_index.extract_artist_index(),
+        folding.compile_search(search, partial_match, swap_words=True),
+        limit=50,
+        ranked=True,
+    )
+
+
+@memoize_in_batch
+def find_annIds(search, partial_match):
+
+    """
+    Return the annIds of the animes having a name matching the search
+    """
+
+    return search_index.get_matching_keys(
+        search_index.extract_anime_index(),
+        folding.compile_search(search, partial_match),
+    )
 
 
 def add_main_log(
@@ -79,15 +134,7 @@ def is_ranked_time():
     return False
 
 
-def get_duplicate_in_list(list, song):
-    for i, song2 in enumerate(list):
-        if song[11] == song2["songName"] and song[12] == song2["songArtist"]:
-            return i
-    return -1
-
-
 def combine_results(
-    artist_database,
     annId_songs_list,
     anime_songs_list,
     songName_songs_list,
@@ -95,80 +142,58 @@ def combine_results(
     composer_songs_list,
     and_logic=False,
     ignore_duplicate=False,
-    max_nb_songs=300,
+    max_nb_songs=None,
 ):
 
-    songId_done = []
+    # With and_logic, a song must be in every non empty list (annId list excepted)
+    intersection_songIds = None
+    if and_logic:
+        for song_list in [
+            anime_songs_list,
+            songName_songs_list,
+            artist_songs_list,
+            composer_songs_list,
+        ]:
+            if not song_list:
+                continue
+            songIds = {song.songId for song in song_list}
+            if intersection_songIds is None:
+                intersection_songIds = songIds
+            else:
+                intersection_songIds &= songIds
+
+    songId_done = set()
+    # (songName, songArtist) -> index in final_song_list
+    duplicate_index = {}
     final_song_list = []
-    for song in (
-        annId_songs_list
-        + anime_songs_list
-        + songName_songs_list
-        + artist_songs_list
-        + composer_songs_list
+    for song in itertools.chain(
+        annId_songs_list,
+        anime_songs_list,
+        songName_songs_list,
+        artist_songs_list,
+        composer_songs_list,
     ):
 
-        if len(final_song_list) >= max_nb_songs:
+        if max_nb_songs is not None and len(final_song_list) >= max_nb_songs:
             break
 
-        if song[7] in songId_done:
+        if song.songId in songId_done:
             continue
 
-        duplicate_ID = get_duplicate_in_list(final_song_list, song)
-        if and_logic:
-            if (
-                (not artist_songs_list or song in artist_songs_list)
-                and (not anime_songs_list or song in anime_songs_list)
-                and (not songName_songs_list or song in songName_songs_list)
-                and (not composer_songs_list or song in composer_songs_list)
-            ):
-                if not ignore_duplicate or duplicate_ID == -1:
-                    songId_done.append(song[7])
-                    final_song_list.append(utils.format_song(artist_database, song))
-                else:
-                    if final_song_list[duplicate_ID]["annId"] > song[0]:
-                        songId_done.append(song[7])
-                        final_song_list[duplicate_ID] = utils.format_song(
-                            artist_database, song
-                        )
-        else:
-            if not ignore_duplicate or duplicate_ID == -1:
-                songId_done.append(song[7])
-                final_song_list.append(utils.format_song(artist_database, song))
-            else:
-                if final_song_list[duplicate_ID]["annId"] > song[0]:
-                    songId_done.append(song[7])
-                    final_song_list[duplicate_ID] = utils.format_song(
-                        artist_database, song
-                    )
-
-    return final_song_list
-
-
-def get_member_list_flat(art_database, artists, bottom=True):
-
-    # If bottom: will skip subgroups and go directly to the lower tier possible
-
-    member_list = []
-
-    for artist, line_up in artists:
-
-        if line_up == -1:
-            member_list.append(int(artist))
-
-        else:
-
-            if not bottom:
-                member_list.append(int(artist))
+        if intersection_songIds is not None and song.songId not in intersection_songIds:
+            continue
 
-            for member in get_member_list_flat(
-                art_database,
-                art_database[str(artist)]["members"][line_up],
-                bottom=bottom,
-            ):
-                member_list.append(int(member))
+        duplicate_key = (song[11], song[12])
+        duplicate_ID = duplicate_index.get(duplicate_key, -1)
+        if not ignore_duplicate or duplicate_ID == -1:
+            songId_done.add(song.songId)
+            duplicate_index.setdefault(duplicate_key, len(final_song_list))
+            final_song_list.append(song)
+        elif final_song_list[duplicate_ID][0] > song[0]:
+            songId_done.add(song.songId)
+            final_song_list[duplicate_ID] = song
 
-    return member_list
+    return final_song_list
 
 
 def compare_two_artist_list(list1, list2):
@@ -185,33 +210,53 @@ def compare_two_artist_list(list1, list2):
     return same_count, add_count
 
 
+def compare_two_artist_masks(mask1, mask2):
+
+    same_count = artist_graph.popcount(mask1 & mask2)
+    add_count = artist_graph.popcount(mask1 & ~mask2)
+
+    return same_count, add_count
+
+
 def check_meets_artists_requirements(
     artist_database, song, artist_ids, group_granularity, max_other_artist
 ):
 
-    song_artists = [
-        [artist, int(line_up)]
-        for artist, line_up in zip(song[13].split(","), song[14].split(","))
-    ]
-    song_artists_flat = get_member_list_flat(artist_database, song_artists)
-
-    for artist_id in artist_ids:
+    song_artists_flat = []
+    for artist, line_up in zip(song[13].split(","), song[14].split(",")):
+        song_artists_flat += artist_graph.get_line_up_members(artist, int(line_up))
+    song_artists_mask = artist_graph.get_artists_mask(song_artists_flat)
 
-        line_ups = [[[str(artist_id), -1]]]
-        if artist_database[str(artist_id)]["members"]:
-            line_ups = artist_database[str(artist_id)]["members"]
+    # Masks can't count an artist credited twice, compare lists in that case
+    has_repetition = len(song_artists_flat) != artist_graph.popcount(song_artists_mask)
 
-        for line_up in line_ups:
+    for artist_id in artist_ids:
 
-            checked_list = get_member_list_flat(artist_database, line_up)
-            present_artist, additional_artist = compare_two_artist_list(
-                song_artists_flat, checked_list
-            )
+        # An artist without members is checked as a line up of its own
+        line_ups = {-1: 1}
+        if artist_database[artist_id]["members"]:
+            line_ups = {
+                line_up: len(members)
+                for line_up, members in enumerate(artist_database[artist_id]["members"])
+            }
+
+        for line_up, line_up_size in line_ups.items():
+
+            if has_repetition:
+                present_artist, additional_artist = compare_two_artist_list(
+                    song_artists_flat,
+                    artist_graph.get_line_up_member_set(artist_id, line_up),
+                )
+            else:
+                present_artist, additional_artist = compare_two_artist_masks(
+                    song_artists_mask,
+                    artist_graph.get_line_up_mask(artist_id, line_up),
+                )
 
             if (
                 present_artist >= 1
                 and additional_artist <= max_other_artist
-                and present_artist >= min(group_granularity, len(line_up))
+                and present_artist >= min(group_granularity, line_up_size)
             ):
 
                 return True
@@ -224,14 +269,29 @@ def get_song_list_from_songIds_JSON(song_database, songIds, authorized_types):
     song_list = []
 
     for songId in songIds:
-        if song_database[songId][9] in authorized_types:
+        if song_database[songId].songType in authorized_types:
             song_list.append(song_database[songId])
 
     return song_list
 
 
+def get_song_list_from_annIds_JSON(
+    anime_database, annIds, authorized_types, max_nb_songs=None
+):
+
+    song_list = []
+
+    for annId in annIds:
+        if int(annId) not in anime_database:
+            continue
+        for song in anime_database[int(annId)]["songs"]:
+            if song.songType in authorized_types:
+                song_list.append(song)
+
+    return song_list[:max_nb_songs]
+
+
 def process_artist(
-    cursor,
     song_database,
     artist_database,
     search,
@@ -239,43 +299,42 @@ def process_artist(
     authorized_types,
     group_granularity,
     max_other_artist,
+    max_nb_songs=None,
 ):
 
-    artist_search = utils.get_regex_search(search, partial_match, swap_words=True)
-
-    artist_ids = sql_calls.get_artist_ids_from_regex(cursor, artist_search)
+    artist_ids = find_artist_ids(search, partial_match)
 
     # If no IDs found, fall back to indexing on songArtist string
     if not artist_ids:
-        artist_songs_list = sql_calls.get_song_list_from_songArtist(
-            cursor, artist_search, authorized_types
+        songIds = search_index.get_matching_keys(
+            search_index.extract_song_artist_index(),
+            folding.compile_search(search, partial_match, swap_words=True),
+            limit=max_nb_songs,
+            partitions=authorized_types,
         )
+        artist_songs_list = [song_database[songId] for songId in songIds]
         return artist_songs_list, artist_ids
 
     # TODO Reuse those process for future processes such as check meet requirement and post process of songs
-    members = []
-    if group_granularity != 0:
-        if group_granularity > 0:
-            for artist in artist_ids:
-                if artist_database[str(artist)]["members"]:
-                    for line_up in artist_database[str(artist)]["members"]:
-                        for member in get_member_list_flat(
-                            artist_database, line_up, bottom=False
-                        ):
-                            if member not in members:
-                                members.append(member)
-                else:
-                    members.append(artist)
+    members = set()
+    if group_granularity > 0:
+        for artist in artist_ids:
+            if artist_database[artist]["members"]:
+                for line_up in range(len(artist_database[artist]["members"])):
+                    members |= artist_graph.get_line_up_member_set(
+                        artist, line_up, bottom=False
+                    )
+            else:
+                members.add(artist)
 
     groups = []
-    for artist in list(set(artist_ids + members)):
-        for group in artist_database[str(artist)]["groups"]:
+    for artist in set(artist_ids) | members:
+        for group in artist_database[artist]["groups"]:
             groups.append(group)
 
     # Extract every song IDs containing an artist we have
     songIds = sql_calls.get_songs_ids_from_artist_ids(
-        cursor,
-        list(set(artist_ids + [group[0] for group in groups] + members)),
+        set(artist_ids) | {group[0] for group in groups} | members
     )
 
     artist_songs_list = get_song_list_from_songIds_JSON(
@@ -295,6 +354,50 @@ def process_artist(
     return final_song_list, artist_ids
 
 
+def get_filter_key(search_filter):
+
+    """
+    Canonicalize a search filter for the result cache
+    """
+
+    if not search_filter:
+        return None
+
+    return (
+        search_filter.search,
+        search_filter.partial_match,
+        search_filter.group_granularity,
+        search_filter.max_other_artist,
+        search_filter.arrangement,
+    )
+
+
+def get_search_results_key(
+    anime_search_filters,
+    song_name_search_filters,
+    artist_search_filters,
+    composer_search_filters,
+    and_logic,
+    ignore_duplicate,
+    max_nb_songs,
+    authorized_types,
+):
+
+    return (
+        get_filter_key(anime_search_filters),
+        get_filter_key(song_name_search_filters),
+        get_filter_key(artist_search_filters),
+        get_filter_key(composer_search_filters),
+        and_logic,
+        ignore_duplicate,
+        max_nb_songs,
+        tuple(sorted(authorized_types)),
+    )
+
+
+# Some filters are disabled during ranked, so results also depend on it
+@snapshot.use_snapshot
+@result_cache.cache_results(get_search_results_key, get_state=is_ranked_time)
 def get_search_results(
     anime_search_filters,
     song_name_search_filters,
@@ -308,11 +411,10 @@ def get_search_results(
 
     startstart = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
     song_database = sql_calls.extract_song_database()
     anime_database = sql_calls.extract_anime_database()
     artist_database = sql_calls.extract_artist_database()
+    song_name_index = search_index.extract_song_name_index()
 
     add_main_log(
         anime_search_filters,
@@ -339,18 +441,13 @@ def get_search_results(
         and song_name_search_filters.search == artist_search_filters.search
     ):
 
-        # Links filter not available during ranked
-        if False:
-            songs = sql_calls.get_song_list_from_links(
-                cursor, anime_search_filters.search
-            )
-            if songs:
-                return [utils.format_song(artist_database, song) for song in songs]
-
         # annId Filter
         if str(anime_search_filters.search).isdigit():
-            annId_songs_list = sql_calls.get_songs_list_from_annIds(
-                cursor, [anime_search_filters.search], authorized_types
+            annId_songs_list = get_song_list_from_annIds_JSON(
+                anime_database,
+                [anime_search_filters.search],
+                authorized_types,
+                max_nb_songs,
             )
 
     print(f"annId on Main: {round(timeit.default_timer() - start, 4)}")
@@ -360,37 +457,13 @@ def get_search_results(
     anime_songs_list = []
     if anime_search_filters:
 
-        anime_search = utils.get_regex_search(
-            anime_search_filters.search, anime_search_filters.partial_match
-        )
-
         anime_songs_list = []
-        for annId in anime_database:
-            anime = anime_database[annId]
-            if not anime["animeJPName"]:
-                if re.match(anime_search, anime["animeExpandName"].lower()):
-                    for song in anime["songs"]:
-                        if song[9] in authorized_types:
-                            anime_songs_list.append(song)
-            else:
-
-                found = False
-                for name in [anime["animeJPName"], anime["animeENName"]] + (
-                    anime["animeAltNames"].split("\$")
-                    if "animeAltNames" in anime and anime["animeAltNames"]
-                    else []
-                ):
-
-                    if not name or found:
-                        continue
-
-                    if re.match(anime_search, name.lower()):
-                        found = True
-
-                if found:
-                    for song in anime["songs"]:
-                        if song[9] in authorized_types:
-                            anime_songs_list.append(song)
+        for annId in find_annIds(
+            anime_search_filters.search, anime_search_filters.partial_match
+        ):
+            for song in anime_database[annId]["songs"]:
+                if song.songType in authorized_types:
+                    anime_songs_list.append(song)
 
     print(f"Anime: {round(timeit.default_timer() - start, 4)}")
     start = timeit.default_timer()
@@ -399,17 +472,15 @@ def get_search_results(
     songName_songs_list = []
     if song_name_search_filters and not is_ranked:
 
-        songName_search = utils.get_regex_search(
-            song_name_search_filters.search, song_name_search_filters.partial_match
+        songIds = search_index.get_matching_keys(
+            song_name_index,
+            folding.compile_search(
+                song_name_search_filters.search,
+                song_name_search_filters.partial_match,
+            ),
+            partitions=authorized_types,
         )
-
-        songName_songs_list = []
-        for songId in song_database:
-            song = song_database[songId]
-            if song[9] in authorized_types and re.match(
-                songName_search, song[11].lower()
-            ):
-                songName_songs_list.append(song)
+        songName_songs_list = [song_database[songId] for songId in songIds]
 
     print(f"Song Name: {round(timeit.default_timer() - start, 4)}")
     start = timeit.default_timer()
@@ -421,7 +492,6 @@ def get_search_results(
     if artist_search_filters and not is_ranked:
 
         artist_songs_list, artist_ids = process_artist(
-            cursor,
             song_database,
             artist_database,
             artist_search_filters.search,
@@ -429,6 +499,7 @@ def get_search_results(
             authorized_types,
             artist_search_filters.group_granularity,
             artist_search_filters.max_other_artist,
+            max_nb_songs,
         )
 
     print(f"Artists: {round(timeit.default_timer() - start, 4)}")
@@ -443,28 +514,25 @@ def get_search_results(
             or composer_search_filters.search != artist_search_filters.search
         ):
 
-            composer_search = utils.get_regex_search(
-                composer_search_filters.search,
-                composer_search_filters.partial_match,
-                swap_words=True,
+            artist_ids = find_artist_ids(
+                composer_search_filters.search, composer_search_filters.partial_match
             )
-            artist_ids = sql_calls.get_artist_ids_from_regex(cursor, composer_search)
 
         if artist_ids:
 
             songIds = sql_calls.get_songs_ids_from_composing_team_ids(
-                cursor, artist_ids, composer_search_filters.arrangement
+                artist_ids,
+                composer_search_filters.arrangement,
+                authorized_types,
+                max_nb_songs,
             )
 
-            composer_songs_list = get_song_list_from_songIds_JSON(
-                song_database, songIds, authorized_types
-            )
+            composer_songs_list = [song_database[songId] for songId in songIds]
 
     print(f"Composers: {round(timeit.default_timer() - start, 4)}")
     start = timeit.default_timer()
 
     song_list = combine_results(
-        artist_database,
         annId_songs_list,
         anime_songs_list,
         songName_songs_list,
@@ -488,6 +556,24 @@ def get_search_results(
     return song_list
 
 
+def get_artists_ids_key(
+    artist_ids,
+    max_other_artist,
+    group_granularity,
+    ignore_duplicate,
+    authorized_types,
+):
+    return (
+        tuple(sorted(set(artist_ids))),
+        max_other_artist,
+        group_granularity,
+        ignore_duplicate,
+        tuple(sorted(authorized_types)),
+    )
+
+
+@snapshot.use_snapshot
+@result_cache.cache_results(get_artists_ids_key)
 def get_artists_ids_song_list(
     artist_ids,
     max_other_artist,
@@ -498,8 +584,6 @@ def get_artists_ids_song_list(
 
     start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
     artist_database = sql_calls.extract_artist_database()
 
     logs = {
@@ -516,11 +600,11 @@ def get_artists_ids_song_list(
 
     groups = []
     for artist in artist_ids:
-        for group in artist_database[str(artist)]["groups"]:
+        for group in artist_database[artist]["groups"]:
             groups.append(group)
 
     songIds = sql_calls.get_songs_ids_from_artist_ids(
-        cursor, list(set(artist_ids + [group[0] for group in groups]))
+        set(artist_ids) | {group[0] for group in groups}
     )
 
     song_database = sql_calls.extract_song_database()
@@ -534,14 +618,12 @@ def get_artists_ids_song_list(
             if int(artist) in artist_ids:
                 flag = True
             for group, group_line_up in groups:
-                if artist == group and int(line_up) == group_line_up:
+                if int(artist) == group and int(line_up) == group_line_up:
                     flag = True
         if flag:
             final_songs.append(song)
 
-    final_songs = combine_results(
-        artist_database, final_songs, [], [], [], [], False, ignore_duplicate
-    )
+    final_songs = combine_results(final_songs, [], [], [], [], False, ignore_duplicate)
 
     stop = timeit.default_timer()
 
@@ -555,18 +637,30 @@ def get_artists_ids_song_list(
     return final_songs
 
 
-def get_composer_ids_song_list(
+def get_composer_ids_key(
     composer_ids,
     arrangement,
     ignore_duplicate,
     authorized_types,
 ):
+    return (
+        tuple(sorted(set(composer_ids))),
+        arrangement,
+        ignore_duplicate,
+        tuple(sorted(authorized_types)),
+    )
 
-    start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+@snapshot.use_snapshot
+@result_cache.cache_results(get_composer_ids_key)
+def get_composer_ids_song_list(
+    composer_ids,
+    arrangement,
+    ignore_duplicate,
+    authorized_types,
+):
 
-    artist_database = sql_calls.extract_artist_database()
+    start = timeit.default_timer()
 
     logs = {
         "date": str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")),
@@ -581,16 +675,14 @@ def get_composer_ids_song_list(
         return []
 
     songIds = sql_calls.get_songs_ids_from_composing_team_ids(
-        cursor, list(set(composer_ids)), arrangement
+        set(composer_ids), arrangement, authorized_types
     )
 
     song_database = sql_calls.extract_song_database()
 
-    songs = get_song_list_from_songIds_JSON(song_database, songIds, authorized_types)
+    songs = [song_database[songId] for songId in songIds]
 
-    final_songs = combine_results(
-        artist_database, songs, [], [], [], [], False, ignore_duplicate
-    )
+    final_songs = combine_results(songs, [], [], [], [], False, ignore_duplicate)
 
     stop = timeit.default_timer()
 
@@ -604,6 +696,16 @@ def get_composer_ids_song_list(
     return final_songs
 
 
+def get_annId_key(
+    annId,
+    ignore_duplicate,
+    authorized_types,
+):
+    return annId, ignore_duplicate, tuple(sorted(authorized_types))
+
+
+@snapshot.use_snapshot
+@result_cache.cache_results(get_annId_key)
 def get_annId_song_list(
     annId,
     ignore_duplicate,
@@ -612,9 +714,7 @@ def get_annId_song_list(
 
     start = timeit.default_timer()
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
-
-    artist_database = sql_calls.extract_artist_database()
+    anime_database = sql_calls.extract_anime_database()
 
     logs = {
         "date": str(datetime.now().strftime("%d/%m/%Y %H:%M:%S")),
@@ -629,11 +729,9 @@ def get_annId_song_list(
     if not str(annId).isdigit():
         return []
 
-    songs = sql_calls.get_songs_list_from_annIds(cursor, [annId], authorized_types)
+    songs = get_song_list_from_annIds_JSON(anime_database, [annId], authorized_types)
 
-    songs = combine_results(
-        artist_database, songs, [], [], [], [], False, ignore_duplicate
-    )
+    songs = combine_results(songs, [], [], [], [], False, ignore_duplicate)
 
     stop = timeit.default_timer()
 
@@ -644,3 +742,70 @@ def get_annId_song_list(
     print()
 
     return songs
+
+
+def get_page(
+    find_songs, args, page_size, cursor=None, encode_song=snapshot.get_formatted_song
+):
+
+    """
+    Run one of the search functions above and return an iterator formatting the songs of one page
+    one by one with encode_song(snapshot, song), and the cursor of the next page (None on the last one)
+    The ordered song IDs found are kept by pagination, so the next pages are cut from them
+    and the search itself isn't kept by the result cache as well
+    Searching and formatting read the same snapshot, even if a new one is swapped in meanwhile
+    """
+
+    current_snapshot = snapshot.get_snapshot()
+    # Cursors expire when the snapshot or the state the results depend on changes
+    version = (current_snapshot["version"], find_songs.get_state())
+    request_key = find_songs.get_key(*args)
+
+    offset = 0
+    if cursor:
+        offset = pagination.decode_cursor(cursor, version, request_key)
+
+    def find_result_ids():
+        songs = snapshot.call_on_snapshot(current_snapshot, find_songs.uncached, *args)
+        return [song.songId for song in songs]
+
+    songIds = pagination.get_result_ids(version, request_key, find_result_ids)
+
+    next_cursor = None
+    if offset + page_size < len(songIds):
+        next_cursor = pagination.encode_cursor(version, request_key, offset + page_size)
+
+    song_database = current_snapshot["song_database"]
+    formatted_songs = (
+        encode_song(current_snapshot, song_database[songId])
+        for songId in songIds[offset : offset + page_size]
+    )
+
+    return formatted_songs, next_cursor
+
+
+def run_batch(searches, page_size, encode_song=snapshot.get_formatted_song):
+
+    """
+    Run searches, (search function, arguments) pairs or None for a search without results,
+    against one snapshot, sharing the artist and anime matches between them
+    Return the songs of the first page of each search, formatted with encode_song, and the cursor of its next page
+    """
+
+    current_snapshot = snapshot.get_snapshot()
+
+    token = batch_memo.set({})
+    try:
+        results = []
+        for search in searches:
+            if search is None:
+                results.append(([], None))
+                continue
+            songs, next_cursor = snapshot.call_on_snapshot(
+                current_snapshot, get_page, *search, page_size, None, encode_song
+            )
+            results.append((list(songs), next_cursor))
+    finally:
+        batch_memo.reset(token)
+
+    return results
@@ -1,11 +1,14 @@
 from __future__ import annotations
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 from typing import List, Optional
 import get_search_result
-import sql_calls, utils
-from random import randrange
+import sql_calls, utils, snapshot, pagination
+from random import sample
+import json
 
 
 class Search_Filter(BaseModel):
@@ -130,6 +133,30 @@ class Song_Entry(BaseModel):
     arrangers: List[artist]
 
 
+class Snapshot_Status(BaseModel):
+
+    served_version: Optional[List[Optional[List[int]]]]
+    database_version: Optional[List[Optional[List[int]]]]
+    loading: bool
+    last_check: Optional[float]
+    last_error: Optional[str]
+
+
+class Batch_Search_Request(BaseModel):
+
+    # Exactly one of them
+    search_request: Optional[Search_Request]
+    artist_ids_request: Optional[Artist_ID_Search_Request]
+    composer_ids_request: Optional[Composer_ID_Search_Request]
+    annId_request: Optional[annId_Search_Request]
+
+
+class Batch_Result(BaseModel):
+
+    songs: List[Song_Entry]
+    next_cursor: Optional[str]
+
+
 # Launch API
 app = FastAPI()
 
@@ -139,12 +166,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
 def format_artist_ids(artist_database, artist_id, artist_line_up=-1):
 
-    artist = artist_database[str(artist_id)]
+    artist = artist_database[artist_id]
 
     formatted_artist = {
         "id": artist_id,
@@ -159,7 +187,7 @@ def format_artist_ids(artist_database, artist_id, artist_line_up=-1):
         for group_id, group_line_up_id in artist["groups"]:
             current_group = {
                 "id": group_id,
-                "names": artist_database[str(group_id)]["names"],
+                "names": artist_database[group_id]["names"],
             }
             if group_line_up_id != -1:
                 current_group["line_up_id"] = group_line_up_id
@@ -171,7 +199,7 @@ def format_artist_ids(artist_database, artist_id, artist_line_up=-1):
         for member_id, member_line_up_id in artist["members"][artist_line_up]:
             current_member = {
                 "id": member_id,
-                "names": artist_database[str(member_id)]["names"],
+                "names": artist_database[member_id]["names"],
             }
             if member_line_up_id:
                 current_member["line_up_id"] = member_line_up_id
@@ -184,68 +212,92 @@ def format_artist_ids(artist_database, artist_id, artist_line_up=-1):
 def format_composer_ids(artist_database, composer_id):
     composer = {"id": composer_id}
 
-    composer["names"] = artist_database[str(composer_id)]["names"]
+    composer["names"] = artist_database[composer_id]["names"]
 
     return composer
 
 
 def format_arranger_ids(artist_database, arranger_id):
     arranger = {"id": arranger_id}
-    arranger["names"] = artist_database[str(arranger_id)]["names"]
+    arranger["names"] = artist_database[arranger_id]["names"]
 
     return arranger
 
 
-@app.post("/api/search_request", response_model=List[Song_Entry])
-async def search_request(query: Search_Request):
+# Documents the opt-in NDJSON streaming of the search endpoints
+# The page is searched in full before the first line is sent: only the encoding of its songs is streamed,
+# as the cursor of the next page is sent in a header and ignore_duplicate can replace a song found earlier
+stream_responses = {
+    200: {
+        "description": "The songs of the page, one per line with stream: the page is searched in full before the first one is sent",
+        "content": {"application/x-ndjson": {}},
+    }
+}
 
-    authorized_type = []
-    if query.opening_filter:
-        authorized_type.append(1)
-    if query.ending_filter:
-        authorized_type.append(2)
-    if query.insert_filter:
-        authorized_type.append(3)
 
-    if not authorized_type:
-        return []
+def encode_song_entry(current_snapshot, song):
 
-    song_list = get_search_result.get_search_results(
-        query.anime_search_filter,
-        query.song_name_search_filter,
-        query.artist_search_filter,
-        query.composer_search_filter,
-        query.and_logic,
-        query.ignore_duplicate,
-        300,
-        authorized_type,
-    )
+    # Song_Entry JSON of a song, validated and encoded like response_model does
+    # only the first time the song is sent with this snapshot
+    song_entries_json = current_snapshot["song_entries_json"]
 
-    return song_list
+    song_entry_json = song_entries_json.get(song.songId)
+    if song_entry_json is None:
+        song_entry = Song_Entry.parse_obj(
+            snapshot.get_formatted_song(current_snapshot, song)
+        )
+        song_entry_json = json.dumps(
+            jsonable_encoder(song_entry), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        song_entries_json[song.songId] = song_entry_json
 
+    return song_entry_json
 
-@app.post("/api/get_50_random_songs", response_model=List[Song_Entry])
-async def get_50_random_songs():
 
-    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+def join_song_entries(song_entries_json):
+    return b"[" + b",".join(song_entries_json) + b"]"
 
-    songIds = [randrange(28000) for i in range(50)]
 
-    artist_database = sql_calls.extract_artist_database()
+def stream_song_entries(song_entries_json):
 
-    # Extract every song from song IDs
-    get_songs_from_songs_ids = (
-        f"SELECT * from songsFull WHERE songId IN ({','.join('?'*len(songIds))})"
-    )
-    songs = sql_calls.run_sql_command(cursor, get_songs_from_songs_ids, songIds)
+    # One Song_Entry per line
+    for song_entry_json in song_entries_json:
+        yield song_entry_json + b"\n"
+
+
+def get_song_page(find_songs, args, page_size, cursor):
+
+    try:
+        return get_search_result.get_page(
+            find_songs, args, page_size, cursor, encode_song_entry
+        )
+    except pagination.ExpiredCursor as error:
+        raise HTTPException(status_code=410, detail=str(error))
+    except pagination.InvalidCursor as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+def build_song_list_response(song_entries_json, next_cursor, stream):
 
-    song_list = [utils.format_song(artist_database, song) for song in songs]
+    # The cursor of the next page is sent in a header so that the body stays a list of songs
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
 
-    return song_list
+    # Songs are already encoded, so response_model is bypassed (it still documents the response)
+    # Stream the songs of the page, already searched, as NDJSON as they are encoded, else send the whole list at once
+    if stream:
+        return StreamingResponse(
+            stream_song_entries(song_entries_json),
+            media_type="application/x-ndjson",
+            headers=headers,
+        )
+    return Response(
+        join_song_entries(song_entries_json),
+        media_type="application/json",
+        headers=headers,
+    )
 
 
-@app.post("/api/artist_ids_request", response_model=List[Song_Entry])
-async def search_request(query: Artist_ID_Search_Request):
+def get_authorized_types(query):
 
     authorized_type = []
     if query.opening_filter:
@@ -255,62 +307,242 @@ async def search_request(query: Artist_ID_Search_Request):
     if query.insert_filter:
         authorized_type.append(3)
 
+    return authorized_type
+
+
+# Each request is turned into its search function and arguments, None if no song type is authorized
+def prepare_search_request(query):
+
+    authorized_type = get_authorized_types(query)
     if not authorized_type:
-        return []
+        return None
 
-    song_list = get_search_result.get_artists_ids_song_list(
+    return get_search_result.get_search_results, [
+        query.anime_search_filter,
+        query.song_name_search_filter,
+        query.artist_search_filter,
+        query.composer_search_filter,
+        query.and_logic,
+        query.ignore_duplicate,
+        pagination.max_nb_results,
+        authorized_type,
+    ]
+
+
+def prepare_artist_ids_request(query):
+
+    authorized_type = get_authorized_types(query)
+    if not authorized_type:
+        return None
+
+    return get_search_result.get_artists_ids_song_list, [
         query.artist_ids,
         query.max_other_artist,
         query.group_granularity,
         query.ignore_duplicate,
         authorized_type,
-    )
+    ]
 
-    return song_list
 
+def prepare_composer_ids_request(query):
 
-@app.post("/api/composer_ids_request", response_model=List[Song_Entry])
-async def search_request(query: Composer_ID_Search_Request):
-
-    authorized_type = []
-    if query.opening_filter:
-        authorized_type.append(1)
-    if query.ending_filter:
-        authorized_type.append(2)
-    if query.insert_filter:
-        authorized_type.append(3)
-
+    authorized_type = get_authorized_types(query)
     if not authorized_type:
-        return []
+        return None
 
-    song_list = get_search_result.get_composer_ids_song_list(
+    return get_search_result.get_composer_ids_song_list, [
         query.composer_ids,
         query.arrangement,
         query.ignore_duplicate,
         authorized_type,
-    )
+    ]
 
-    return song_list
 
+def prepare_annId_request(query):
 
-@app.post("/api/annId_request", response_model=List[Song_Entry])
-async def search_request(query: annId_Search_Request):
-
-    authorized_type = []
-    if query.opening_filter:
-        authorized_type.append(1)
-    if query.ending_filter:
-        authorized_type.append(2)
-    if query.insert_filter:
-        authorized_type.append(3)
-
+    authorized_type = get_authorized_types(query)
     if not authorized_type:
-        return []
+        return None
 
-    song_list = get_search_result.get_annId_song_list(
+    return get_search_result.get_annId_song_list, [
         query.annId,
         query.ignore_duplicate,
         authorized_type,
+    ]
+
+
+# Requests a batch can hold, one per item
+batch_request_kinds = {
+    "search_request": prepare_search_request,
+    "artist_ids_request": prepare_artist_ids_request,
+    "composer_ids_request": prepare_composer_ids_request,
+    "annId_request": prepare_annId_request,
+}
+max_batch_size = 100
+
+
+@app.on_event("startup")
+async def load_snapshot():
+
+    # Load the data before serving, then watch for a new database
+    snapshot.get_snapshot()
+    snapshot.start_watcher()
+
+
+@app.post("/api/admin/reload_database", response_model=Snapshot_Status)
+async def reload_database():
+
+    # Only checks the database file, a new snapshot is loaded if it changed
+    return snapshot.check_for_new_database()
+
+
+@app.post(
+    "/api/search_request", response_model=List[Song_Entry], responses=stream_responses
+)
+async def search_request(
+    query: Search_Request,
+    stream: bool = False,
+    page_size: int = Query(
+        pagination.default_page_size, ge=1, le=pagination.max_page_size
+    ),
+    cursor: Optional[str] = None,
+):
+
+    search = prepare_search_request(query)
+    if search is None:
+        return build_song_list_response(iter([]), None, stream)
+
+    song_list, next_cursor = get_song_page(*search, page_size, cursor)
+
+    return build_song_list_response(song_list, next_cursor, stream)
+
+
+@app.post("/api/get_50_random_songs", response_model=List[Song_Entry])
+async def get_50_random_songs():
+
+    current_snapshot = snapshot.get_snapshot()
+
+    # Distinct song IDs, each song is sent once
+    songIds = sorted(sample(range(28000), 50))
+
+    song_database = current_snapshot["song_database"]
+
+    # Extract every song from song IDs
+    songs = [song_database[songId] for songId in songIds if songId in song_database]
+
+    return Response(
+        join_song_entries(encode_song_entry(current_snapshot, song) for song in songs),
+        media_type="application/json",
     )
 
-    return song_list
+
+@app.post(
+    "/api/artist_ids_request",
+    response_model=List[Song_Entry],
+    responses=stream_responses,
+)
+async def search_request(
+    query: Artist_ID_Search_Request,
+    stream: bool = False,
+    page_size: int = Query(
+        pagination.default_page_size, ge=1, le=pagination.max_page_size
+    ),
+    cursor: Optional[str] = None,
+):
+
+    search = prepare_artist_ids_request(query)
+    if search is None:
+        return build_song_list_response(iter([]), None, stream)
+
+    song_list, next_cursor = get_song_page(*search, page_size, cursor)
+
+    return build_song_list_response(song_list, next_cursor, stream)
+
+
+@app.post(
+    "/api/composer_ids_request",
+    response_model=List[Song_Entry],
+    responses=stream_responses,
+)
+async def search_request(
+    query: Composer_ID_Search_Request,
+    stream: bool = False,
+    page_size: int = Query(
+        pagination.default_page_size, ge=1, le=pagination.max_page_size
+    ),
+    cursor: Optional[str] = None,
+):
+
+    search = prepare_composer_ids_request(query)
+    if search is None:
+        return build_song_list_response(iter([]), None, stream)
+
+    song_list, next_cursor = get_song_page(*search, page_size, cursor)
+
+    return build_song_list_response(song_list, next_cursor, stream)
+
+
+@app.post(
+    "/api/annId_request", response_model=List[Song_Entry], responses=stream_responses
+)
+async def search_request(
+    query: annId_Search_Request,
+    stream: bool = False,
+    page_size: int = Query(
+        pagination.default_page_size, ge=1, le=pagination.max_page_size
+    ),
+    cursor: Optional[str] = None,
+):
+
+    search = prepare_annId_request(query)
+    if search is None:
+        return build_song_list_response(iter([]), None, stream)
+
+    song_list, next_cursor = get_song_page(*search, page_size, cursor)
+
+    return build_song_list_response(song_list, next_cursor, stream)
+
+
+@app.post("/api/batch_request", response_model=List[Batch_Result])
+async def batch_request(
+    queries: List[Batch_Search_Request],
+    page_size: int = Query(
+        pagination.default_page_size, ge=1, le=pagination.max_page_size
+    ),
+):
+
+    if len(queries) > max_batch_size:
+        raise HTTPException(
+            status_code=400, detail=f"At most {max_batch_size} requests per batch"
+        )
+
+    searches = []
+    for query in queries:
+        requests = [
+            (kind, getattr(query, kind))
+            for kind in batch_request_kinds
+            if getattr(query, kind) is not None
+        ]
+        if len(requests) != 1:
+            raise HTTPException(
+                status_code=400,
+                detail="Each request of a batch needs exactly one of "
+                + ", ".join(batch_request_kinds),
+            )
+        kind, request = requests[0]
+        searches.append(batch_request_kinds[kind](request))
+
+    # Results in the same order as the requests
+    results = get_search_result.run_batch(searches, page_size, encode_song_entry)
+
+    batch_results_json = [
+        b'{"songs":'
+        + join_song_entries(songs)
+        + b',"next_cursor":'
+        + json.dumps(next_cursor).encode("utf-8")
+        + b"}"
+        for songs, next_cursor in results
+    ]
+    return Response(
+        b"[" + b",".join(batch_results_json) + b"]", media_type="application/json"
+    )
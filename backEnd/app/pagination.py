@@ -0,0 +1,100 @@
+"""
+Opaque cursors of the paginated search results
+
+A cursor holds the offset of the next page, a digest of the request it continues
+and a digest of the version of its results: the snapshot version and the state they depend on
+(ranked time), so it never resumes another request, another database or another state
+It is self contained: any worker of the host can serve the next page
+
+The ordered song IDs of a request are kept under the digests of its cursor,
+pages are cut from them, and a request evicted from there is searched again
+This is the only cache of the API's search results, the searches are called past the result cache
+"""
+
+from collections import OrderedDict
+from array import array
+import base64, hashlib, json
+
+default_page_size = 300
+max_page_size = 1000
+
+# Most songs a free text search returns over all its pages
+max_nb_results = 3000
+
+max_cached_result_ids = 1024
+cached_result_ids = OrderedDict()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class ExpiredCursor(InvalidCursor):
+    pass
+
+
+def get_digest(value):
+    return hashlib.sha256(repr(value).encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(version, request_key, offset):
+
+    """
+    Return the cursor of the page starting at offset
+    """
+
+    cursor = json.dumps([get_digest(version), get_digest(request_key), offset])
+    return base64.urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, version, request_key):
+
+    """
+    Return the offset a cursor points to
+    Raise InvalidCursor if it can't be read or belongs to another request,
+    ExpiredCursor if a new snapshot was loaded or the state of the results changed since it was given
+    """
+
+    try:
+        cursor = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise InvalidCursor("Invalid cursor")
+
+    if (
+        not isinstance(cursor, list)
+        or len(cursor) != 3
+        or not isinstance(cursor[0], str)
+        or not isinstance(cursor[1], str)
+        or type(cursor[2]) != int
+    ):
+        raise InvalidCursor("Invalid cursor")
+    version_digest, request_digest, offset = cursor
+
+    if request_digest != get_digest(request_key):
+        raise InvalidCursor("Cursor doesn't match the request")
+    if version_digest != get_digest(version):
+        raise ExpiredCursor("Cursor expired, the results changed since")
+
+    return max(offset, 0)
+
+
+def get_result_ids(version, request_key, find_result_ids):
+
+    """
+    Return the ordered song IDs found for a request, calling find_result_ids()
+    only if they aren't kept for this request and version yet
+    """
+
+    key = (get_digest(version), get_digest(request_key))
+
+    if key in cached_result_ids:
+        cached_result_ids.move_to_end(key)
+        return cached_result_ids[key]
+
+    result_ids = array("l", find_result_ids())
+
+    cached_result_ids[key] = result_ids
+    if len(cached_result_ids) > max_cached_result_ids:
+        cached_result_ids.popitem(last=False)
+
+    return result_ids
@@ -0,0 +1,96 @@
+"""
+Cache of the search results, keyed by the canonicalized request and the snapshot version
+It serves direct calls of the search functions, the API pages through pagination instead,
+which keeps the ordered song IDs of each request and calls the searches uncached,
+so that a result list isn't held by both
+Results of older versions are dropped once, when a new snapshot is served,
+requests still pinned to an older one cache theirs beside the new ones until evicted
+"""
+
+from collections import OrderedDict
+from functools import wraps
+import snapshot
+
+max_cached_results = 1024
+
+cached_results = OrderedDict()
+cache_stats = {"version": None, "hits": 0, "misses": 0}
+
+
+def get_database_version():
+
+    """
+    Return the version of the database the snapshot in use was loaded from
+    """
+
+    return snapshot.get_snapshot()["version"]
+
+
+def get_served_version():
+
+    """
+    Return the version of the snapshot new requests are served
+    """
+
+    return snapshot.current_snapshot["version"]
+
+
+def drop_older_versions():
+
+    """
+    Drop the cached results of other versions than the one served, once per new snapshot
+    """
+
+    served_version = get_served_version()
+    if served_version == cache_stats["version"]:
+        return
+
+    for key in [key for key in cached_results if key[1] != served_version]:
+        del cached_results[key]
+    cache_stats["version"] = served_version
+
+
+def get_no_state():
+    return None
+
+
+def cache_results(get_key, get_state=get_no_state):
+
+    """
+    Cache the results of the decorated function, get_key canonicalizes its arguments
+    and get_state returns what else its results depend on (ranked time, ...)
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args):
+
+            version = get_database_version()
+            drop_older_versions()
+
+            key = (function.__name__, version, get_state(), get_key(*args))
+
+            if key in cached_results:
+                cached_results.move_to_end(key)
+                cache_stats["hits"] += 1
+                return cached_results[key]
+
+            cache_stats["misses"] += 1
+            result = function(*args)
+
+            cached_results[key] = result
+            if len(cached_results) > max_cached_results:
+                cached_results.popitem(last=False)
+
+            return result
+
+        # Identifies a request, used to check that a cursor resumes the same one
+        wrapper.get_key = get_key
+        # Not part of the request, a change expires its cursors instead
+        wrapper.get_state = get_state
+        # For callers keeping the results themselves
+        wrapper.uncached = function
+
+        return wrapper
+
+    return decorator
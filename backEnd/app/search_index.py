@@ -0,0 +1,221 @@
+import snapshot, folding
+
+
+def build_trigram_index(entries):
+
+    """
+    Build a trigram index from a list of (key, names) or (key, names, partition) entries
+    Names are stored folded and results are returned in the same order as the entries
+    Each partition (song type, ...) gets its own postings so filtering on it is free
+    """
+
+    keys = []
+    folded_names = []
+    partitions = {}
+    postings = {}
+    for position, (key, names, *partition) in enumerate(entries):
+
+        partition = partition[0] if partition else None
+
+        keys.append(key)
+        folded_names.append(
+            [form for name in names if name for form in folding.get_folded_forms(name)]
+        )
+        partitions.setdefault(partition, []).append(position)
+
+        trigrams = set()
+        for folded_name in folded_names[-1]:
+            trigrams |= folding.get_trigrams(folded_name)
+        partition_postings = postings.setdefault(partition, {})
+        for trigram in trigrams:
+            partition_postings.setdefault(trigram, []).append(position)
+
+    return {
+        "keys": keys,
+        "folded_names": folded_names,
+        "partitions": partitions,
+        "postings": postings,
+    }
+
+
+def get_candidates(index, terms_trigrams, partitions=[None]):
+
+    """
+    Return the sorted positions of every entry of the partitions that might match one of the terms
+    """
+
+    positions = set()
+    for partition in partitions:
+
+        if partition not in index["partitions"]:
+            continue
+
+        partition_postings = index["postings"][partition]
+        for trigrams in terms_trigrams:
+
+            # Nothing to filter on, every entry is a candidate
+            if not trigrams:
+                positions.update(index["partitions"][partition])
+                break
+
+            posting_lists = []
+            for trigram in trigrams:
+                if trigram not in partition_postings:
+                    break
+                posting_lists.append(partition_postings[trigram])
+            else:
+                posting_lists.sort(key=len)
+                term_positions = set(posting_lists[0])
+                for posting_list in posting_lists[1:]:
+                    term_positions.intersection_update(posting_list)
+                positions |= term_positions
+
+    return sorted(positions)
+
+
+def get_matching_keys(
+    index, compiled_search, limit=None, partitions=[None], ranked=False
+):
+
+    """
+    Return the keys of the entries of the partitions having a name matching the compiled search
+    If ranked, entries named as the search come first, then the ones having it as whole words,
+    so that the limit can't cut the one searched for off behind loose substring matches
+    """
+
+    terms = compiled_search["terms"]
+    partial_match = compiled_search["partial_match"]
+    candidates = get_candidates(index, compiled_search["trigrams"], partitions)
+
+    if not ranked:
+        keys = []
+        for position in candidates:
+            if limit is not None and len(keys) >= limit:
+                break
+            for folded_name in index["folded_names"][position]:
+                if folding.match(folded_name, terms, partial_match):
+                    keys.append(index["keys"][position])
+                    break
+        return keys
+
+    # Keys by match rank, in the order of the entries in each rank
+    ranked_keys = [[], [], []]
+    for position in candidates:
+
+        if limit is not None and len(ranked_keys[0]) >= limit:
+            break
+
+        ranks = [
+            folding.get_match_rank(folded_name, terms, partial_match)
+            for folded_name in index["folded_names"][position]
+        ]
+        ranks = [rank for rank in ranks if rank is not None]
+        if ranks and (limit is None or len(ranked_keys[min(ranks)]) < limit):
+            ranked_keys[min(ranks)].append(index["keys"][position])
+
+    return (ranked_keys[0] + ranked_keys[1] + ranked_keys[2])[:limit]
+
+
+def extract_anime_index():
+
+    """
+    Return the anime index of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["anime_index"]
+
+
+def extract_artist_index():
+
+    """
+    Return the artist index of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["artist_index"]
+
+
+def extract_song_name_index():
+
+    """
+    Return the song name index of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["song_name_index"]
+
+
+def extract_song_artist_index():
+
+    """
+    Return the song artist index of the current snapshot
+    """
+
+    return snapshot.get_snapshot()["song_artist_index"]
+
+
+def build_anime_index(anime_database):
+
+    """
+    Build the trigram index on the names searched for every anime
+    """
+
+    entries = []
+    for annId, anime in anime_database.items():
+        if not anime["animeJPName"]:
+            names = [anime["animeExpandName"]]
+        else:
+            names = [anime["animeJPName"], anime["animeENName"]] + (
+                anime["animeAltNames"].split("\$") if anime["animeAltNames"] else []
+            )
+        entries.append((annId, names))
+
+    return build_trigram_index(entries)
+
+
+def build_artist_index(artist_database):
+
+    """
+    Build the trigram index on every name of every artist
+    """
+
+    entries = [
+        (artist_id, artist_database[artist_id]["names"])
+        for artist_id in sorted(artist_database)
+    ]
+
+    return build_trigram_index(entries)
+
+
+def build_song_name_index(store):
+
+    """
+    Build the trigram index on every song name, partitioned by song type
+    """
+
+    return build_trigram_index(
+        [
+            (songId, [songName], songType)
+            for songId, songName, songType in zip(
+                store.get_column("songId"),
+                store.get_column("songName"),
+                store.get_column("songType"),
+            )
+        ]
+    )
+
+
+def build_song_artist_index(store):
+
+    """
+    Build the trigram index on every song artist, partitioned by song type
+    """
+
+    return build_trigram_index(
+        [
+            (songId, [songArtist], songType)
+            for songId, songArtist, songType in zip(
+                store.get_column("songId"),
+                store.get_column("songArtist"),
+                store.get_column("songType"),
+            )
+        ]
+    )
@@ -0,0 +1,337 @@
+"""
+Everything the API keeps in memory, loaded from the database in a single pass:
+the song, anime and artist databases, the artist graph and every search index
+
+It is read from the memory mapped snapshot file when there is an up to date one,
+shared by every worker of the host, else from the database
+
+When a new database file is dropped in, a new snapshot is loaded in the background
+and swapped in as a whole, requests being handled finish on the snapshot they started with
+"""
+
+import sql_calls, search_index, artist_graph, song_store, snapshot_file, utils
+import os
+from functools import wraps
+from contextvars import ContextVar
+import threading, timeit, time
+
+
+def get_private_memory():
+
+    """
+    Return the private resident memory of the process in MiB, its resident pages not backed by a file
+    (so not the pages of the mapped snapshot file shared by every worker), None if it can't be read
+    """
+
+    try:
+        # Linux only, sizes in pages
+        with open("/proc/self/statm") as statm:
+            resident, shared = [int(size) for size in statm.read().split()[1:3]]
+    except (OSError, ValueError):
+        return None
+
+    return (resident - shared) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def get_source_version():
+
+    """
+    Return the versions of the database file and of the snapshot file (None if there is none)
+    """
+
+    try:
+        stat = os.stat(snapshot_file.snapshot_file_path)
+        snapshot_file_version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        snapshot_file_version = None
+
+    return (
+        sql_calls.get_database_file_version(sql_calls.database_path),
+        snapshot_file_version,
+    )
+
+
+def read_from_database():
+
+    """
+    Read the parts of a snapshot stored in the database
+    """
+
+    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+
+    return {
+        "input_hash": sql_calls.read_input_hash(cursor),
+        "song_store": sql_calls.read_song_store(cursor),
+        "artist_database": sql_calls.read_artist_database(cursor),
+        "artist_songs_database": sql_calls.read_artist_songs_database(cursor),
+        "composing_team_database": sql_calls.read_composing_team_database(cursor),
+    }
+
+
+def read_from_snapshot_file():
+
+    """
+    Read the parts of a snapshot stored in the snapshot file,
+    None if it is missing, corrupted or wasn't built from the same inputs as the database
+    """
+
+    cursor = sql_calls.connect_to_database(sql_calls.database_path)
+    input_hash = sql_calls.read_input_hash(cursor)
+    if input_hash is None:
+        return None
+
+    snapshot_file_data = snapshot_file.read_snapshot_file(input_hash=input_hash)
+    if snapshot_file_data is None:
+        print("No up to date snapshot file, loading from the database")
+        return None
+
+    contents, data = snapshot_file_data
+    data["input_hash"] = contents["input_hash"]
+    return data
+
+
+def load_snapshot(use_snapshot_file=True):
+
+    """
+    Load a new snapshot, from the snapshot file if it is up to date else from the database
+    """
+
+    start = timeit.default_timer()
+    memory_start = get_private_memory()
+
+    version = get_source_version()
+
+    data = read_from_snapshot_file() if use_snapshot_file else None
+    source = "snapshot file"
+    if data is None:
+        data = read_from_database()
+        source = "database"
+
+    store = data["song_store"]
+    artist_database = data["artist_database"]
+
+    song_database, anime_database = song_store.index_songs(store)
+
+    line_up_database = artist_graph.build_line_up_database(artist_database)
+    artist_bits = artist_graph.build_artist_bits(
+        artist_database, store, line_up_database
+    )
+
+    snapshot = {
+        "version": version,
+        "source": source,
+        "input_hash": data["input_hash"],
+        "song_store": store,
+        "song_database": song_database,
+        "anime_database": anime_database,
+        "artist_database": artist_database,
+        "artist_songs_database": data["artist_songs_database"],
+        "composing_team_database": data["composing_team_database"],
+        "line_up_database": line_up_database,
+        "artist_bits": artist_bits,
+        "line_up_masks": artist_graph.build_line_up_masks(
+            line_up_database, artist_bits
+        ),
+        # songId -> formatted song and Song_Entry JSON, filled while serving
+        "formatted_songs": {},
+        "song_entries_json": {},
+    }
+
+    # Indexes are stored in the snapshot file
+    if "anime_index" in data:
+        for name in snapshot_file.INDEXES:
+            snapshot[name] = data[name]
+    else:
+        snapshot["anime_index"] = search_index.build_anime_index(anime_database)
+        snapshot["artist_index"] = search_index.build_artist_index(artist_database)
+        snapshot["song_name_index"] = search_index.build_song_name_index(store)
+        snapshot["song_artist_index"] = search_index.build_song_artist_index(store)
+
+    if warm_up_formatted_songs:
+        for song in song_database.values():
+            get_formatted_song(snapshot, song)
+
+    snapshot["load_time"] = timeit.default_timer() - start
+    # Growth of the private resident memory while loading, the previous snapshot being still in use
+    memory_end = get_private_memory()
+    if memory_start is not None and memory_end is not None:
+        snapshot["memory"] = memory_end - memory_start
+    else:
+        snapshot["memory"] = None
+
+    print(
+        f"Snapshot loaded from the {source}: {len(song_database)} songs, {len(anime_database)} animes, {len(artist_database)} artists"
+    )
+    print(f"Snapshot load time: {round(snapshot['load_time'], 4)}")
+    if snapshot["memory"] is not None:
+        print(f"Snapshot private memory: {round(snapshot['memory'], 1)} MiB")
+    print()
+
+    return snapshot
+
+
+def get_formatted_song(snapshot, song):
+
+    """
+    Return the song formatted by utils.format_song, only formatted once per snapshot
+    The formatted song is shared and must not be modified
+    """
+
+    formatted_songs = snapshot["formatted_songs"]
+
+    formatted_song = formatted_songs.get(song.songId)
+    if formatted_song is None:
+        formatted_song = utils.format_song(snapshot["artist_database"], song)
+        formatted_songs[song.songId] = formatted_song
+
+    return formatted_song
+
+
+# Snapshot served to new requests, only ever replaced as a whole
+current_snapshot = None
+# Snapshot the request being handled started with
+pinned_snapshot = ContextVar("pinned_snapshot", default=None)
+
+# Held while a snapshot is being loaded
+loading_lock = threading.Lock()
+reload_status = {"loading": False, "last_check": None, "last_error": None}
+
+# Seconds between two checks of the database file by the watcher
+watcher_interval = 30
+
+# Format every song when a snapshot is loaded instead of on first use
+warm_up_formatted_songs = False
+
+
+def get_snapshot():
+
+    """
+    Return the snapshot pinned by the current request, else the one currently served
+    The first snapshot is loaded on first use
+    """
+
+    global current_snapshot
+
+    snapshot = pinned_snapshot.get()
+    if snapshot is not None:
+        return snapshot
+
+    if current_snapshot is None:
+        with loading_lock:
+            if current_snapshot is None:
+                current_snapshot = load_snapshot()
+
+    return current_snapshot
+
+
+def call_on_snapshot(snapshot, function, *args):
+
+    """
+    Call function with snapshot pinned
+    """
+
+    token = pinned_snapshot.set(snapshot)
+    try:
+        return function(*args)
+    finally:
+        pinned_snapshot.reset(token)
+
+
+def use_snapshot(function):
+
+    """
+    Pin the current snapshot for the whole call of the decorated function
+    so that a swap never happens in the middle of a request
+    """
+
+    @wraps(function)
+    def wrapper(*args):
+
+        if pinned_snapshot.get() is not None:
+            return function(*args)
+
+        return call_on_snapshot(get_snapshot(), function, *args)
+
+    return wrapper
+
+
+def reload_in_background():
+
+    """
+    Load a new snapshot in a background thread and swap it in once ready
+    Return False if a snapshot is already being loaded
+    """
+
+    if not loading_lock.acquire(blocking=False):
+        return False
+
+    reload_status["loading"] = True
+
+    def reload():
+
+        global current_snapshot
+
+        try:
+            current_snapshot = load_snapshot()
+            reload_status["last_error"] = None
+        except Exception as error:
+            print("\n", error, "\n")
+            reload_status["last_error"] = str(error)
+        finally:
+            reload_status["loading"] = False
+            loading_lock.release()
+
+    threading.Thread(target=reload, daemon=True).start()
+    return True
+
+
+def check_for_new_database():
+
+    """
+    Start loading a new snapshot if the database file changed since the current one was loaded
+    Return the version served and the reload status
+    """
+
+    reload_status["last_check"] = time.time()
+
+    try:
+        version = get_source_version()
+    except OSError as error:
+        print("\n", error, "\n")
+        version = None
+
+    served_version = current_snapshot["version"] if current_snapshot else None
+    if version is not None and version != served_version:
+        reload_in_background()
+
+    return {
+        "served_version": served_version,
+        "database_version": version,
+        **reload_status,
+    }
+
+
+def start_watcher(interval=watcher_interval):
+
+    """
+    Check the database file every interval seconds in a background thread
+    """
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            check_for_new_database()
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+def build_snapshot_file():
+
+    """
+    Write the snapshot file of the database from the database itself
+    """
+
+    new_snapshot = load_snapshot(use_snapshot_file=False)
+    snapshot_file.write_snapshot_file(
+        new_snapshot, contents={"input_hash": new_snapshot["input_hash"]}
+    )
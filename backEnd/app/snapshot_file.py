@@ -0,0 +1,516 @@
+"""
+Binary snapshot file, memory mapped read only so that every worker of a host shares one copy
+of the song columns, the search indexes and the song IDs of every artist, composer and arranger
+
+The file starts with a table of contents (JSON) followed by 8 bytes aligned sections,
+each one a flat native array read in place through memoryviews
+The table of contents holds the format version, the content hash of the inputs of the database
+it was built from, the byte size of every typecode on the writing machine
+and a SHA-256 checksum of the sections, checked before anything is read
+Its build hash also covers the format and the code folding names into the search indexes,
+so a file written before new folding rules is never read
+The artist graph is small and rebuilt by each worker from its sections
+"""
+
+import json, mmap, struct, sys, bisect, hashlib
+from array import array
+from pathlib import Path
+import song_store, artist_graph
+
+snapshot_file_path = Path("data") / Path("Enhanced-AMQ-Snapshot.bin")
+
+MAGIC = b"AMQSNAP\0"
+FORMAT_VERSION = 4
+
+# Code building the search indexes, next to this file
+INDEX_SOURCES = ["folding.py", "search_index.py"]
+
+INDEXES = ["anime_index", "artist_index", "song_name_index", "song_artist_index"]
+ROLES = ["composers", "arrangers"]
+
+
+class PackedStrings:
+
+    """
+    Read only sequence of strings (or None) packed in a file
+    """
+
+    __slots__ = ("offsets", "nulls", "data")
+
+    def __init__(self, offsets, nulls, data):
+        self.offsets = offsets
+        self.nulls = nulls
+        self.data = data
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, position):
+        if self.nulls[position]:
+            return None
+        return str(
+            self.data[self.offsets[position] : self.offsets[position + 1]], "utf-8"
+        )
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+
+class PackedLists:
+
+    """
+    Read only sequence of integer lists packed in a file, every list is a memoryview
+    """
+
+    __slots__ = ("offsets", "values")
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return self.values[self.offsets[position] : self.offsets[position + 1]]
+
+
+class PackedStringLists:
+
+    """
+    Read only sequence of string lists packed in a file
+    """
+
+    __slots__ = ("offsets", "strings")
+
+    def __init__(self, offsets, strings):
+        self.offsets = offsets
+        self.strings = strings
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return [
+            self.strings[i]
+            for i in range(self.offsets[position], self.offsets[position + 1])
+        ]
+
+
+class PackedMapping:
+
+    """
+    Read only mapping of sorted keys (integers or strings) to integer lists packed in a file
+    """
+
+    __slots__ = ("keys", "lists")
+
+    def __init__(self, keys, lists):
+        self.keys = keys
+        self.lists = lists
+
+    def find(self, key):
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return position
+        return -1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return self.find(key) != -1
+
+    def __getitem__(self, key):
+        position = self.find(key)
+        if position == -1:
+            raise KeyError(key)
+        return self.lists[position]
+
+    def get(self, key, default=None):
+        position = self.find(key)
+        return default if position == -1 else self.lists[position]
+
+
+def add_array(sections, name, typecode, values):
+    sections[name] = (typecode, array(typecode, values).tobytes())
+
+
+def add_strings(sections, name, strings):
+
+    offsets = array("q", [0])
+    nulls = array("b")
+    data = bytearray()
+    for string in strings:
+        nulls.append(string is None)
+        if string is not None:
+            data += string.encode("utf-8")
+        offsets.append(len(data))
+
+    sections[name + ".offsets"] = ("q", offsets.tobytes())
+    sections[name + ".nulls"] = ("b", nulls.tobytes())
+    sections[name + ".data"] = ("B", bytes(data))
+
+
+def add_lists(sections, name, lists):
+
+    offsets = array("q", [0])
+    values = array("q")
+    for values_list in lists:
+        values.fromlist(list(values_list))
+        offsets.append(len(values))
+
+    sections[name + ".offsets"] = ("q", offsets.tobytes())
+    sections[name + ".values"] = ("q", values.tobytes())
+
+
+def add_string_lists(sections, name, lists):
+
+    offsets = array("q", [0])
+    strings = []
+    for strings_list in lists:
+        strings += strings_list
+        offsets.append(len(strings))
+
+    sections[name + ".offsets"] = ("q", offsets.tobytes())
+    add_strings(sections, name + ".strings", strings)
+
+
+def add_mapping(sections, name, mapping):
+
+    keys = sorted(mapping)
+    if keys and isinstance(keys[0], str):
+        add_strings(sections, name + ".keys", keys)
+    else:
+        add_array(sections, name + ".keys", "q", keys)
+    add_lists(sections, name + ".lists", [mapping[key] for key in keys])
+
+
+def add_trigram_index(sections, contents, name, index):
+
+    """
+    Pack a trigram index, partitions are listed in the table of contents
+    """
+
+    add_array(sections, name + ".keys", "q", index["keys"])
+    add_string_lists(sections, name + ".folded_names", index["folded_names"])
+
+    partitions = list(index["partitions"])
+    contents["partitions"][name] = partitions
+    for i, partition in enumerate(partitions):
+        add_array(
+            sections,
+            f"{name}.{i}.positions",
+            "q",
+            index["partitions"][partition],
+        )
+        add_mapping(sections, f"{name}.{i}.postings", index["postings"][partition])
+
+
+def get_build_hash(input_hash):
+
+    """
+    Return the hash of a snapshot file built from the inputs hashed as input_hash
+    with this format and these search index sources
+    """
+
+    build_hash = hashlib.sha256(f"{input_hash}:{FORMAT_VERSION}".encode("utf-8"))
+    for source in INDEX_SOURCES:
+        source_bytes = Path(__file__).with_name(source).read_bytes()
+        build_hash.update(hashlib.sha256(source_bytes).digest())
+
+    return build_hash.hexdigest()
+
+
+def write_snapshot_file(snapshot, path=None, contents=None):
+
+    """
+    Write everything the snapshot keeps in memory to a binary snapshot file
+    The file is written next to its destination then moved over it
+    """
+
+    path = Path(path or snapshot_file_path)
+
+    contents = dict(contents or {})
+    contents["format"] = FORMAT_VERSION
+    contents["build_hash"] = get_build_hash(contents.get("input_hash"))
+    contents["byteorder"] = sys.byteorder
+    contents["partitions"] = {}
+    contents["composing_team_types"] = {}
+
+    sections = {}
+
+    # Songs
+    store = snapshot["song_store"]
+    for column in song_store.ANIME_COLUMNS:
+        if column == "annId":
+            add_array(sections, "animes.annId", "q", store.anime_columns["annId"])
+        else:
+            add_strings(sections, f"animes.{column}", store.anime_columns[column])
+    add_array(sections, "songs.anime_rows", "q", store.anime_rows)
+    for column, values in store.columns.items():
+        if column in song_store.NUMERIC_COLUMNS:
+            add_array(
+                sections,
+                f"songs.{column}",
+                song_store.NUMERIC_COLUMNS[column],
+                values,
+            )
+        else:
+            add_strings(sections, f"songs.{column}", values)
+
+    # Artists
+    artist_database = snapshot["artist_database"]
+    add_array(sections, "artists.id", "q", artist_database.keys())
+    add_string_lists(
+        sections,
+        "artists.names",
+        [artist["names"] for artist in artist_database.values()],
+    )
+    add_array(
+        sections,
+        "artists.vocalist",
+        "b",
+        [artist["vocalist"] for artist in artist_database.values()],
+    )
+    add_array(
+        sections,
+        "artists.composer",
+        "b",
+        [artist["composer"] for artist in artist_database.values()],
+    )
+    add_lists(
+        sections,
+        "artists.groups",
+        [
+            [value for group in artist["groups"] for value in group]
+            for artist in artist_database.values()
+        ],
+    )
+    add_array(
+        sections,
+        "artists.line_up_counts",
+        "q",
+        [len(artist["members"]) for artist in artist_database.values()],
+    )
+    add_lists(
+        sections,
+        "artists.members",
+        [
+            [value for member in line_up for value in member]
+            for artist in artist_database.values()
+            for line_up in artist["members"]
+        ],
+    )
+
+    # Song IDs of every artist, composer and arranger
+    add_mapping(sections, "artist_songs", snapshot["artist_songs_database"])
+    for role in ROLES:
+        types = list(snapshot["composing_team_database"].get(role, {}))
+        contents["composing_team_types"][role] = types
+        for songType in types:
+            add_mapping(
+                sections,
+                f"{role}.{songType}",
+                snapshot["composing_team_database"][role][songType],
+            )
+
+    # Search indexes
+    for name in INDEXES:
+        add_trigram_index(sections, contents, name, snapshot[name])
+
+    # Lay out the sections after the table of contents, 8 bytes aligned
+    contents["sections"] = {}
+    checksum = hashlib.sha256()
+    offset = 0
+    for name, (typecode, data) in sections.items():
+        contents["sections"][name] = [offset, len(data), typecode]
+        offset += len(data) + (-len(data) % 8)
+        checksum.update(data)
+        checksum.update(b"\0" * (-len(data) % 8))
+    contents["checksum"] = checksum.hexdigest()
+
+    # "l" is 8 bytes on Linux but 4 on Windows, a reader checks it sizes them as the writer did
+    contents["itemsizes"] = {
+        typecode: array(typecode).itemsize for typecode, _ in sections.values()
+    }
+
+    table = json.dumps(contents).encode("utf-8")
+    header = MAGIC + struct.pack("<Q", len(table)) + table
+    header += b"\0" * (-len(header) % 8)
+
+    temporary_path = path.with_name(path.name + ".tmp")
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        for typecode, data in sections.values():
+            file.write(data)
+            file.write(b"\0" * (-len(data) % 8))
+    temporary_path.replace(path)
+
+    print(
+        f"Snapshot file written: {path} ({round((len(header) + offset) / 2**20, 1)} MiB)"
+    )
+
+
+def read_contents(file):
+
+    """
+    Read the table of contents of an opened snapshot file, None if it isn't one
+    """
+
+    if file.read(len(MAGIC)) != MAGIC:
+        return None, 0
+    (table_size,) = struct.unpack("<Q", file.read(8))
+    contents = json.loads(file.read(table_size))
+
+    header_size = len(MAGIC) + 8 + table_size
+    return contents, header_size + (-header_size % 8)
+
+
+def is_readable(contents):
+
+    """
+    Check that the snapshot file was written in this format on a compatible machine
+    """
+
+    if contents is None or contents["format"] != FORMAT_VERSION:
+        return False
+    if contents["byteorder"] != sys.byteorder:
+        return False
+    return all(
+        array(typecode).itemsize == struct.calcsize(typecode) == itemsize
+        for typecode, itemsize in contents["itemsizes"].items()
+    )
+
+
+def read_snapshot_file(path=None, input_hash=None):
+
+    """
+    Map a snapshot file and return its table of contents and the parts of the snapshot it holds,
+    None if there is no readable snapshot file, if it is corrupted, built from other inputs than input_hash
+    or by other search index sources
+    """
+
+    path = Path(path or snapshot_file_path)
+
+    try:
+        with open(path, "rb") as file:
+            contents, data_start = read_contents(file)
+            if not is_readable(contents):
+                return None
+            if input_hash is not None:
+                if contents.get("build_hash") != get_build_hash(input_hash):
+                    return None
+            mapped_file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as error:
+        print("\n", error, "\n")
+        return None
+
+    view = memoryview(mapped_file)
+
+    if hashlib.sha256(view[data_start:]).hexdigest() != contents["checksum"]:
+        print("\n", f"Snapshot file {path} is corrupted", "\n")
+        return None
+
+    def read(name):
+        offset, length, typecode = contents["sections"][name]
+        offset += data_start
+        return view[offset : offset + length].cast(typecode)
+
+    def read_strings(name):
+        return PackedStrings(
+            read(name + ".offsets"), read(name + ".nulls"), read(name + ".data")
+        )
+
+    def read_lists(name):
+        return PackedLists(read(name + ".offsets"), read(name + ".values"))
+
+    def read_string_lists(name):
+        return PackedStringLists(
+            read(name + ".offsets"), read_strings(name + ".strings")
+        )
+
+    def read_mapping(name):
+        if name + ".keys" in contents["sections"]:
+            keys = read(name + ".keys")
+        else:
+            keys = read_strings(name + ".keys")
+        return PackedMapping(keys, read_lists(name + ".lists"))
+
+    # Songs
+    anime_columns = {}
+    for column in song_store.ANIME_COLUMNS:
+        if column == "annId":
+            anime_columns[column] = read("animes.annId")
+        else:
+            anime_columns[column] = read_strings(f"animes.{column}")
+    columns = {}
+    for column in song_store.SONG_COLUMNS[len(song_store.ANIME_COLUMNS) :]:
+        if column in song_store.NUMERIC_COLUMNS:
+            columns[column] = read(f"songs.{column}")
+        else:
+            columns[column] = read_strings(f"songs.{column}")
+    store = song_store.SongStore(anime_columns, read("songs.anime_rows"), columns)
+
+    # Artists, rebuilt in memory
+    artist_database = artist_graph.ArtistDatabase()
+    names = read_string_lists("artists.names")
+    vocalist = read("artists.vocalist")
+    composer = read("artists.composer")
+    groups = read_lists("artists.groups")
+    line_up_counts = read("artists.line_up_counts")
+    members = read_lists("artists.members")
+    line_up = 0
+    for position, artist_id in enumerate(read("artists.id")):
+        artist_groups = groups[position]
+        artist_members = []
+        for _ in range(line_up_counts[position]):
+            line_up_members = members[line_up]
+            artist_members.append(
+                [
+                    [line_up_members[i], line_up_members[i + 1]]
+                    for i in range(0, len(line_up_members), 2)
+                ]
+            )
+            line_up += 1
+        artist_database[artist_id] = {
+            "names": names[position],
+            "groups": [
+                [artist_groups[i], artist_groups[i + 1]]
+                for i in range(0, len(artist_groups), 2)
+            ],
+            "members": artist_members,
+            "vocalist": bool(vocalist[position]),
+            "composer": bool(composer[position]),
+        }
+
+    data = {
+        "song_store": store,
+        "artist_database": artist_database,
+        "artist_songs_database": read_mapping("artist_songs"),
+        "composing_team_database": {
+            role: {
+                songType: read_mapping(f"{role}.{songType}")
+                for songType in contents["composing_team_types"][role]
+            }
+            for role in ROLES
+        },
+    }
+
+    # Search indexes
+    for name in INDEXES:
+        partitions = contents["partitions"][name]
+        data[name] = {
+            "keys": read(name + ".keys"),
+            "folded_names": read_string_lists(name + ".folded_names"),
+            "partitions": {
+                partition: read(f"{name}.{i}.positions")
+                for i, partition in enumerate(partitions)
+            },
+            "postings": {
+                partition: read_mapping(f"{name}.{i}.postings")
+                for i, partition in enumerate(partitions)
+            },
+        }
+
+    return contents, data
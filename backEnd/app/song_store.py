@@ -0,0 +1,248 @@
+"""
+Compact column store of the songs of a snapshot
+
+Numeric columns are kept in typed arrays, anime fields once per anime,
+and the strings shared by many songs (artists, credits, ...) are interned so they are stored once.
+Songs are read through Song, a light view that can still be indexed like a songsFull row
+"""
+
+from array import array
+import sys, math
+
+# Columns of songsFull, in order
+SONG_COLUMNS = [
+    "annId",
+    "animeExpandName",
+    "animeJPName",
+    "animeENName",
+    "altNames",
+    "animeVintage",
+    "animeType",
+    "songId",
+    "annSongId",
+    "songType",
+    "songNumber",
+    "songName",
+    "songArtist",
+    "artists",
+    "artists_line_up",
+    "composers",
+    "arrangers",
+    "songDifficulty",
+    "songCategory",
+    "HQ",
+    "MQ",
+    "audio",
+]
+
+# Stored once per anime
+ANIME_COLUMNS = SONG_COLUMNS[:7]
+
+# Stored in typed arrays, NULL is kept as MISSING (NaN for floats)
+NUMERIC_COLUMNS = {
+    "songId": "l",
+    "annSongId": "l",
+    "songType": "b",
+    "songNumber": "h",
+    "songDifficulty": "d",
+}
+
+MISSING = -1
+
+# Song strings repeated across songs, links are unique and never interned
+INTERNED_COLUMNS = {
+    "songName",
+    "songArtist",
+    "artists",
+    "artists_line_up",
+    "composers",
+    "arrangers",
+    "songCategory",
+}
+
+
+def intern_value(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Song:
+
+    """
+    View on one song of a store, indexed like a songsFull row
+    songId and songType, read by every filter, are also kept as attributes
+    """
+
+    __slots__ = ("store", "row", "songId", "songType")
+
+    def __init__(self, store, row, songId, songType):
+        self.store = store
+        self.row = row
+        self.songId = songId
+        self.songType = songType
+
+    def __getitem__(self, column):
+        return self.store.getters[column](self.row)
+
+    def __len__(self):
+        return len(SONG_COLUMNS)
+
+    def __iter__(self):
+        return iter(self.store.get_row(self.row))
+
+    def __repr__(self):
+        return f"Song{tuple(self)}"
+
+
+class SongStore:
+
+    """
+    Columns of every song, rows in songsFull order
+    """
+
+    __slots__ = (
+        "anime_columns",
+        "anime_positions",
+        "anime_rows",
+        "columns",
+        "getters",
+    )
+
+    def __init__(self, anime_columns=None, anime_rows=None, columns=None):
+
+        """
+        Start an empty store, or wrap existing columns (lists, arrays or any sequence)
+        """
+
+        if anime_columns is None:
+            anime_columns = {column: [] for column in ANIME_COLUMNS}
+            anime_rows = array("l")
+            columns = {}
+            for column in SONG_COLUMNS[len(ANIME_COLUMNS) :]:
+                if column in NUMERIC_COLUMNS:
+                    columns[column] = array(NUMERIC_COLUMNS[column])
+                else:
+                    columns[column] = []
+
+        self.anime_columns = anime_columns
+        # annId -> position in the anime columns
+        self.anime_positions = {
+            annId: position for position, annId in enumerate(anime_columns["annId"])
+        }
+        # Song row -> position in the anime columns
+        self.anime_rows = anime_rows
+        self.columns = columns
+
+        self.getters = [self.get_getter(column) for column in SONG_COLUMNS]
+
+    def __len__(self):
+        return len(self.anime_rows)
+
+    def get_getter(self, column):
+
+        """
+        Return the function reading a column for a song row
+        """
+
+        if column in ANIME_COLUMNS:
+            anime_column = self.anime_columns[column]
+            anime_rows = self.anime_rows
+            return lambda row: anime_column[anime_rows[row]]
+
+        values = self.columns[column]
+
+        if NUMERIC_COLUMNS.get(column) == "d":
+            return lambda row: None if math.isnan(values[row]) else values[row]
+        if column in NUMERIC_COLUMNS:
+            return lambda row: None if values[row] == MISSING else values[row]
+        return values.__getitem__
+
+    def append(self, song):
+
+        """
+        Add a songsFull row
+        """
+
+        annId = song[0]
+        if annId not in self.anime_positions:
+            self.anime_positions[annId] = len(self.anime_positions)
+            for column, value in zip(ANIME_COLUMNS, song):
+                self.anime_columns[column].append(intern_value(value))
+        self.anime_rows.append(self.anime_positions[annId])
+
+        for column, value in zip(SONG_COLUMNS[len(ANIME_COLUMNS) :], song[7:]):
+            if NUMERIC_COLUMNS.get(column) == "d":
+                value = math.nan if value is None else value
+            elif column in NUMERIC_COLUMNS:
+                value = MISSING if value is None else value
+            elif column in INTERNED_COLUMNS:
+                value = intern_value(value)
+            self.columns[column].append(value)
+
+    def get_song(self, row):
+
+        """
+        Return the view on a song row
+        """
+
+        return Song(self, row, self.getters[7](row), self.getters[9](row))
+
+    def get_row(self, row):
+
+        """
+        Return every column of a song row as a songsFull tuple
+        """
+
+        return tuple([getter(row) for getter in self.getters])
+
+    def get_anime(self, annId):
+
+        """
+        Return the anime fields of an anime
+        """
+
+        position = self.anime_positions[annId]
+        return {
+            column: self.anime_columns[column][position] for column in ANIME_COLUMNS
+        }
+
+    def get_column(self, column):
+
+        """
+        Return a whole song column, indexed by song row
+        """
+
+        if column in ANIME_COLUMNS:
+            return [
+                self.anime_columns[column][position] for position in self.anime_rows
+            ]
+        return self.columns[column]
+
+
+def index_songs(store):
+
+    """
+    Return the song database (songId -> Song) and the anime database (annId -> anime fields and Songs) of a store
+    """
+
+    song_database = {}
+    anime_database = {}
+    for row in range(len(store)):
+
+        song = store.get_song(row)
+        song_database[song.songId] = song
+
+        annId = song[0]
+        if annId not in anime_database:
+            anime = store.get_anime(annId)
+            anime_database[annId] = {
+                "animeExpandName": anime["animeExpandName"],
+                "animeJPName": anime["animeJPName"],
+                "animeENName": anime["animeENName"],
+                "animeAltNames": anime["altNames"],
+                "animeVintage": anime["animeVintage"],
+                "animeType": anime["animeType"],
+                "songs": [],
+            }
+        anime_database[annId]["songs"].append(song)
+
+    return song_database, anime_database
@@ -1,143 +1,208 @@
-import sqlite3, re
+import sqlite3, heapq, os, threading
 from pathlib import Path
-from functools import lru_cache
-import timeit
+from array import array
+import snapshot, artist_graph, song_store
 
 local_path = Path("data")
 database_path = local_path / Path("Enhanced-AMQ-Database.db")
 
+# One connection per thread, reused by every request handled by that thread
+connection_pool = threading.local()
+
+# Serving mode: the database file is opened immutable (no locking) and memory mapped,
+# so a new database must be dropped in by replacing the file, never rebuilt in place
+serving_mode = True
+# Page cache size in KiB
+serving_cache_size = 65536
+
 
-@lru_cache(maxsize=None)
 def extract_song_database():
 
     """
-    Extract the song database
+    Return the song database of the current snapshot
     """
 
-    command = """
-    SELECT * FROM songsFull;
-    """
+    return snapshot.get_snapshot()["song_database"]
 
-    cursor = connect_to_database(database_path)
 
-    song_database = {}
-    for song in run_sql_command(cursor, command):
+def extract_anime_database():
 
-        song_database[song[7]] = song
+    """
+    Return the anime database of the current snapshot
+    """
 
-    return song_database
+    return snapshot.get_snapshot()["anime_database"]
 
 
-@lru_cache(maxsize=None)
-def extract_anime_database():
+def extract_artist_database():
 
     """
-    Extract the song database
+    Return the artist database of the current snapshot
     """
 
-    command = """
-    SELECT * FROM songsFull;
+    return snapshot.get_snapshot()["artist_database"]
+
+
+def extract_artist_songs_database():
+
+    """
+    Return the song IDs of every artist of the current snapshot
     """
 
-    cursor = connect_to_database(database_path)
+    return snapshot.get_snapshot()["artist_songs_database"]
 
-    anime_database = {}
-    for song in run_sql_command(cursor, command):
 
-        if song[0] not in anime_database:
-            anime_database[song[0]] = {
-                "animeExpandName": song[1],
-                "animeJPName": song[2],
-                "animeENName": song[3],
-                "animeAltNames": song[4],
-                "animeVintage": song[5],
-                "animeType": song[6],
-                "songs": [],
-            }
-        anime_database[song[0]]["songs"].append(song)
+def extract_composing_team_database():
 
-    return anime_database
+    """
+    Return the song IDs of every composer and arranger of the current snapshot
+    """
 
+    return snapshot.get_snapshot()["composing_team_database"]
 
-@lru_cache(maxsize=None)
-def extract_artist_database():
 
+def read_song_store(cursor):
+
+    """
+    Read every song in a single pass over songsFull
     """
-    Extract the artist database
+
+    command = """
+    SELECT * FROM songsFull;
     """
 
-    cursor = connect_to_database(database_path)
+    store = song_store.SongStore()
+    for row in run_sql_command(cursor, command):
+        store.append(row)
+
+    return store
+
+
+def read_artist_database(cursor):
+
+    """
+    Read the artist database, keyed by artist ID, with the groups and members of every artist
+    The artist graph is rebuilt in a single ordered pass over link_artist_group:
+    members keep the order in which they first appear in the group
+    """
 
     extract_basic_info = """
     SELECT id, names, vocalist, composer FROM artistsNames
     """
 
-    basic_info = run_sql_command(cursor, extract_basic_info)
+    artist_database = artist_graph.ArtistDatabase()
+    for artist_id, names, vocalist, composer in run_sql_command(
+        cursor, extract_basic_info
+    ):
+        artist_database[artist_id] = {
+            "names": names.split("\$"),
+            "groups": [],
+            "members": [],
+            "vocalist": True if vocalist else False,
+            "composer": True if composer else False,
+        }
 
-    extract_artist_groups = """
-    SELECT id, groups, groups_line_up FROM artistsGroups
+    extract_links = """
+    SELECT group_id, group_line_up_id, member_id, member_line_up_id FROM link_artist_group
+    ORDER BY group_id, group_line_up_id, member_id, member_line_up_id
     """
 
-    artist_groups = run_sql_command(cursor, extract_artist_groups)
+    def sort_members(group_id, member_ranks):
+        for line_up in artist_database[group_id]["members"]:
+            line_up.sort(key=lambda member: member_ranks[member[0]])
+
+    current_group_id = None
+    member_ranks = {}
+    for group_id, group_line_up, member_id, member_line_up in run_sql_command(
+        cursor, extract_links
+    ):
+
+        if group_id != current_group_id:
+            if current_group_id is not None:
+                sort_members(current_group_id, member_ranks)
+            current_group_id = group_id
+            member_ranks = {}
+        member_ranks.setdefault(member_id, len(member_ranks))
+
+        artist_database[member_id]["groups"].append([group_id, group_line_up])
+
+        members = artist_database[group_id]["members"]
+        while len(members) <= group_line_up:
+            members.append([])
+
+        # Same member in the line up under several of its own line ups, keep the first
+        if members[group_line_up] and members[group_line_up][-1][0] == member_id:
+            continue
+        members[group_line_up].append([member_id, member_line_up])
+
+    if current_group_id is not None:
+        sort_members(current_group_id, member_ranks)
+
+    return artist_database
+
+
+def read_artist_songs_database(cursor):
+
+    """
+    Read for every artist the sorted array of the song IDs it is credited on
+    """
 
-    extract_group_members = """
-    SELECT id, members, members_line_up FROM artistsMembers
+    command = """
+    SELECT artist_id, song_id FROM link_song_artist ORDER BY artist_id, song_id;
     """
 
-    group_members = run_sql_command(cursor, extract_group_members)
+    artist_songs_database = {}
+    for artist_id, song_id in run_sql_command(cursor, command):
+        songIds = artist_songs_database.setdefault(artist_id, array("l"))
+        # Same song credited with different line ups
+        if not songIds or songIds[-1] != song_id:
+            songIds.append(song_id)
 
-    if len(basic_info) != len(artist_groups) or len(basic_info) != len(group_members):
-        print("ERROR EXTRACTING ARTIST DATABASE")
-        return {}
+    return artist_songs_database
 
-    artist_database = {}
-    for info, groups in zip(basic_info, artist_groups):
 
-        if info[0] != groups[0]:
-            print("ERROR EXTRACTING ARTIST DATABASE")
-            return {}
+def read_composing_team_database(cursor):
 
-        artist_database[str(info[0])] = {
-            "names": info[1].split("\$"),
-            "groups": [
-                [group, int(line_up)]
-                for group, line_up in zip(groups[1].split(","), groups[2].split(","))
-            ]
-            if groups[1]
-            else [],
-            "members": [],
-            "vocalist": True if info[2] else False,
-            "composer": True if info[3] else False,
-        }
+    """
+    Read for every composer and arranger the sorted array of the song IDs they worked on,
+    partitioned by song type: {"composers": {songType: {id: array}}, "arrangers": ...}
+    """
 
-    for info, members in zip(basic_info, group_members):
+    composing_team_database = {}
+    for role, link_table, id_column in [
+        ("composers", "link_song_composer", "composer_id"),
+        ("arrangers", "link_song_arranger", "arranger_id"),
+    ]:
 
-        if info[0] != members[0]:
-            print("ERROR EXTRACTING ARTIST DATABASE")
-            return {}
+        command = f"""
+        SELECT {link_table}.{id_column}, songs.songType, songs.id
+        FROM {link_table}
+        INNER JOIN songs ON songs.id = {link_table}.song_id
+        ORDER BY {link_table}.{id_column}, songs.id;
+        """
 
-        if not members[1]:
-            continue
+        composing_team_database[role] = {}
+        for artist_id, songType, song_id in run_sql_command(cursor, command):
+            composing_team_database[role].setdefault(songType, {}).setdefault(
+                artist_id, array("l")
+            ).append(song_id)
 
-        for member_id, line_up in zip(members[1].split(","), members[2].split(",")):
-            member = artist_database[str(member_id)]
-            for group_id, group_line_up in member["groups"]:
-                if int(group_id) == int(info[0]):
-                    while (
-                        len(artist_database[str(info[0])]["members"]) <= group_line_up
-                    ):
-                        artist_database[str(info[0])]["members"].append([])
-                    if member_id not in [
-                        mid[0]
-                        for mid in artist_database[str(info[0])]["members"][
-                            group_line_up
-                        ]
-                    ]:
-                        artist_database[str(info[0])]["members"][group_line_up].append(
-                            [member_id, int(line_up)]
-                        )
+    return composing_team_database
 
-    return artist_database
+
+def read_input_hash(cursor):
+
+    """
+    Read the content hash of the inputs the database was built from, None for older databases
+    """
+
+    try:
+        cursor.execute("SELECT value FROM build_info WHERE key = 'input_hash';")
+        record = cursor.fetchone()
+    except sqlite3.Error:
+        return None
+
+    return record[0] if record else None
 
 
 def run_sql_command(cursor, sql_command, data=None):
@@ -177,125 +242,105 @@ def run_sql_command(cursor, sql_command, data=None):
         return None
 
 
-def regexp(expr, item):
-    try:
-        reg = re.compile(expr)
-        return reg.search(item) is not None
-    except Exception as e:
-        pass
-
-
-def connect_to_database(database_path):
+def get_database_file_version(database_path):
 
     """
-    Connect to the database and return the connection's cursor
+    Identify the database file, a new file dropped in gets a new version
     """
 
-    try:
-        sqliteConnection = sqlite3.connect(database_path)
-        sqliteConnection.create_function("REGEXP", 2, regexp)
-        cursor = sqliteConnection.cursor()
-        return cursor
-    except sqlite3.Error as error:
-        print("\n", error, "\n")
-        exit(0)
-
+    stat = os.stat(database_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
 
-def get_songs_list_from_annIds(cursor, annIds, authorized_types):
-    get_songs_from_annId = f"SELECT * from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND annId IN ({','.join('?'*len(annIds))}) LIMIT 300"
-    return run_sql_command(cursor, get_songs_from_annId, authorized_types + annIds)
 
+def open_connection(database_path):
 
-def get_annId_from_anime(cursor, regex, authorized_types=[1, 2, 3]):
-
-    # TODO Indexes on lower ?
-    get_animeID_from_animeName = f"SELECT annId from animes WHERE (lower(animeENName) REGEXP ? OR lower(animeJPName) REGEXP ?) LIMIT 300"
-    return [
-        id[0]
-        for id in run_sql_command(cursor, get_animeID_from_animeName, [regex, regex])
-    ]
-
+    """
+    Open a read only connection to the database and register the functions used in queries
+    """
 
-def get_song_list_from_song_name(cursor, regex, authorized_types=[1, 2, 3]):
+    uri = f"{Path(database_path).resolve().as_uri()}?mode=ro"
+    if serving_mode:
+        uri += "&immutable=1"
 
-    start = timeit.default_timer()
-    # TODO Indexes on lower ?
-    get_animeID_from_songName = f"SELECT * from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND lower(songName) REGEXP ? LIMIT 300"
-    results = run_sql_command(
-        cursor, get_animeID_from_songName, authorized_types + [regex]
-    )
-    print()
-    print(len(results))
-    print(f"Song List from Song Name SQL: {round(timeit.default_timer() - start, 4)}")
-    print()
-    return results
+    sqliteConnection = sqlite3.connect(uri, uri=True, cached_statements=256)
 
+    if serving_mode:
+        # Workers share the OS page cache of the mapped file
+        mmap_size = os.path.getsize(database_path)
+        sqliteConnection.execute(f"PRAGMA mmap_size = {mmap_size}")
+        sqliteConnection.execute(f"PRAGMA cache_size = -{serving_cache_size}")
 
-def get_song_list_from_songArtist(cursor, regex, authorized_types=[1, 2, 3]):
+    return sqliteConnection
 
-    # TODO Indexes on lower ?
-    get_song_list_from_songArtist = f"SELECT * from songsFull WHERE songType IN ({','.join('?'*len(authorized_types))}) AND lower(songArtist) REGEXP ? LIMIT 300"
-    return run_sql_command(
-        cursor, get_song_list_from_songArtist, authorized_types + [regex]
-    )
 
+def connect_to_database(database_path):
 
-def get_songs_ids_from_artist_ids(cursor, artist_ids):
+    """
+    Return a cursor on this thread's pooled connection to the database
+    The connection is reopened when the database file is replaced
+    """
 
-    get_songs_ids_from_artist_ids = f"SELECT song_id from link_song_artist WHERE artist_id IN ({','.join('?'*len(artist_ids))})"
-    return [
-        id[0]
-        for id in run_sql_command(
-            cursor, get_songs_ids_from_artist_ids, [str(id) for id in artist_ids]
-        )
-    ]
+    try:
+        version = (database_path, get_database_file_version(database_path))
 
+        if getattr(connection_pool, "version", None) != version:
+            if getattr(connection_pool, "connection", None) is not None:
+                connection_pool.connection.close()
+            connection_pool.connection = open_connection(database_path)
+            connection_pool.version = version
 
-def get_songs_ids_from_composing_team_ids(cursor, composer_ids, arrangement):
+        return connection_pool.connection.cursor()
+    except (sqlite3.Error, OSError) as error:
+        print("\n", error, "\n")
+        exit(0)
 
-    # TODO FIND A BETTER WAY WITH VIEW
-    get_songs_ids_from_composer_ids = f"SELECT song_id from link_song_composer WHERE composer_id IN ({','.join('?'*len(composer_ids))}) LIMIT 300"
-    songIds = set()
-    for song_id in run_sql_command(
-        cursor, get_songs_ids_from_composer_ids, composer_ids
-    ):
-        songIds.add(song_id[0])
 
-    if arrangement:
-        get_songs_ids_from_arranger_ids = f"SELECT song_id from link_song_arranger WHERE arranger_id IN ({','.join('?'*len(composer_ids))}) LIMIT 300"
-        for song_id in run_sql_command(
-            cursor, get_songs_ids_from_arranger_ids, composer_ids
-        ):
-            songIds.add(song_id[0])
+def get_songs_ids_from_artist_ids(artist_ids):
 
-    songIds = list(songIds)
+    """
+    Return the sorted song IDs crediting at least one of the artists
+    """
 
-    return songIds
+    artist_songs_database = extract_artist_songs_database()
 
+    songIds = set()
+    for artist_id in artist_ids:
+        songIds.update(artist_songs_database.get(int(artist_id), ()))
 
-def get_artist_ids_from_regex(cursor, regex):
+    return sorted(songIds)
 
-    # TODO Index on lower ?
-    get_artist_ids_from_regex = "SELECT artist_id from artist_names WHERE lower(name) REGEXP ? GROUP BY artist_id LIMIT 50"
-    artist_ids = [
-        id[0] for id in run_sql_command(cursor, get_artist_ids_from_regex, [regex])
-    ]
-    return artist_ids
 
+def get_songs_ids_from_composing_team_ids(
+    composer_ids, arrangement, authorized_types=[1, 2, 3], limit=None
+):
 
-def get_song_list_from_links(cursor, link):
+    """
+    Return the sorted song IDs of the authorized types composed (or arranged) by one of the artists,
+    only the first limit ones of each role if there is a limit
+    """
 
-    if "catbox.moe" not in link or (".webm" not in link and ".mp3" not in link):
-        return []
+    composing_team_database = extract_composing_team_database()
 
-    link = f".*{link}.*"
+    roles = ["composers", "arrangers"] if arrangement else ["composers"]
 
-    # TODO Indexes ?
-    get_songs_from_link = (
-        f"SELECT * from songsFull WHERE HQ REGEXP ? OR MQ REGEXP ? OR audio REGEXP ?"
-    )
-    songs = run_sql_command(cursor, get_songs_from_link, [link, link, link])
-    return songs
+    songIds = set()
+    for role in roles:
+        postings = []
+        for songType in authorized_types:
+            partition = composing_team_database[role].get(songType, {})
+            for composer_id in composer_ids:
+                postings.append(partition.get(int(composer_id), ()))
+
+        role_songIds = []
+        for song_id in heapq.merge(*postings):
+            if role_songIds and role_songIds[-1] == song_id:
+                continue
+            if limit is not None and len(role_songIds) >= limit:
+                break
+            role_songIds.append(song_id)
+        songIds.update(role_songIds)
+
+    return sorted(songIds)
 
 
 def get_artist_names_from_artist_id(cursor, artist_id):
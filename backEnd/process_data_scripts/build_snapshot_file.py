@@ -0,0 +1,15 @@
+"""
+Write again the memory mapped snapshot file the API workers share from the SQL database,
+convert_to_SQL.py already writes it after every build
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+import sql_calls, snapshot, snapshot_file
+
+sql_calls.database_path = Path("../app/data/Enhanced-AMQ-Database.db")
+snapshot_file.snapshot_file_path = Path("../app/data/Enhanced-AMQ-Snapshot.bin")
+
+snapshot.build_snapshot_file()
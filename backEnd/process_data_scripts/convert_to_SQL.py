@@ -1,19 +1,39 @@
 """
 Convert the mapping in JSON generated by process_artists scripts to an SQL database for production use
+then write the binary snapshot of it loaded by the API
 """
 
+import os, sys
 import sqlite3
 import json
+import hashlib
 from pathlib import Path
 
+# The snapshot is built by the API code
+sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
+import sql_calls, snapshot, snapshot_file
+
 database = Path("../app/data/Enhanced-AMQ-Database.db")
+# Built beside the database, then moved over it, so the API never reads a half built one
+temporary_database = database.with_name(database.name + ".tmp")
+snapshot_path = Path("../app/data/Enhanced-AMQ-Snapshot.bin")
 song_database_path = Path("../app/data/song_database.json")
 artist_database_path = Path("../app/data/artist_database.json")
 
-with open(song_database_path, encoding="utf-8") as json_file:
-    song_database = json.load(json_file)
-with open(artist_database_path, encoding="utf-8") as json_file:
-    artist_database = json.load(json_file)
+with open(song_database_path, "rb") as json_file:
+    song_database_bytes = json_file.read()
+with open(artist_database_path, "rb") as json_file:
+    artist_database_bytes = json_file.read()
+
+song_database = json.loads(song_database_bytes)
+artist_database = json.loads(artist_database_bytes)
+
+# Content hash of the inputs, recorded in the database and in the snapshot built from it
+# (the snapshot file mixes it with its format version and the sources of the search indexes)
+input_hash = hashlib.sha256()
+for input_bytes in [song_database_bytes, artist_database_bytes]:
+    input_hash.update(hashlib.sha256(input_bytes).digest())
+input_hash = input_hash.hexdigest()
 
 
 RESET_DB_SQL = """
@@ -34,13 +54,14 @@ DROP VIEW IF EXISTS artistsNames;
 DROP VIEW IF EXISTS artistsMembers;
 DROP VIEW IF EXISTS artistsLineUps;
 DROP VIEW IF EXISTS artistsGroups;
-DROP VIEW IF EXISTS artistsFull;
+DROP VIEW IF EXISTS artistsFullView;
 DROP VIEW IF EXISTS animesFull;
 DROP VIEW IF EXISTS songsAnimes;
 DROP VIEW IF EXISTS songsArtists;
 DROP VIEW IF EXISTS songsComposers;
 DROP VIEW IF EXISTS songsArrangers;
-DROP VIEW IF EXISTS songsFull;
+DROP VIEW IF EXISTS songsFullView;
+DROP TABLE IF EXISTS build_info;
 
 PRAGMA foreign_keys = 1;
 
@@ -168,6 +189,11 @@ create TABLE link_anime_altNames (
     PRIMARY KEY (annId, name)
 );
 
+create TABLE build_info (
+    "key" VARCHAR(255) PRIMARY KEY,
+    "value" TEXT
+);
+
 CREATE VIEW artistsNames AS 
 SELECT orderedNames.inserted_order, artists.id, group_concat(orderedNames.name, "\$") AS names, artists.vocalist, artists.composer
 FROM artists
@@ -194,7 +220,7 @@ LEFT JOIN link_artist_group ON artists.id = link_artist_group.group_id
 LEFT JOIN artistsNames ON artists.id = artistsNames.id
 GROUP BY artists.id, link_artist_group.group_line_up_id;
 
-CREATE VIEW artistsFull AS
+CREATE VIEW artistsFullView AS
 SELECT artistsNames.id, artistsNames.names, artistsNames.vocalist, artistsNames.composer, artistsMembers.members, artistsMembers.members_line_up, artistsGroups.groups, artistsGroups.groups_line_up
 FROM artistsNames
 INNER JOIN artistsMembers ON artistsNames.id = artistsMembers.id
@@ -231,7 +257,7 @@ FROM songs
 LEFT JOIN link_song_arranger ON songs.id = link_song_arranger.song_id
 GROUP BY songs.id;
 
-CREATE VIEW songsFull AS
+CREATE VIEW songsFullView AS
 SELECT songsAnimes.annId, songsAnimes.animeExpandName, songsAnimes.animeJPName, songsAnimes.animeENName, songsAnimes.altNames, songsAnimes.animeVintage, songsAnimes.animeType, 
 songsAnimes.songId, songsAnimes.annSongId, songsAnimes.songType, songsAnimes.songNumber, songsAnimes.songName, songsAnimes.songArtist, songsArtists.artists, songsArtists.artists_line_up, songsComposers.composers, songsArrangers.arrangers, songsAnimes.songDifficulty, songsAnimes.songCategory, songsAnimes.HQ, songsAnimes.MQ, songsAnimes.audio
 FROM songsAnimes
@@ -240,6 +266,18 @@ INNER JOIN songsComposers ON songsAnimes.songId = songsComposers.songId
 INNER JOIN songsArrangers ON songsAnimes.songId = songsArrangers.songId;
 """
 
+# Evaluated once the database is filled, so the API reads plain tables
+MATERIALIZE_VIEWS_SQL = """
+CREATE TABLE songsFull AS SELECT * FROM songsFullView;
+CREATE INDEX songsFull_songId ON songsFull (songId);
+CREATE INDEX songsFull_annId ON songsFull (annId);
+CREATE INDEX songsFull_songType ON songsFull (songType);
+CREATE INDEX songsFull_annSongId ON songsFull (annSongId);
+
+CREATE TABLE artistsFull AS SELECT * FROM artistsFullView;
+CREATE INDEX artistsFull_id ON artistsFull (id);
+"""
+
 
 def run_sql_command(cursor, sql_command, data=None):
 
@@ -478,8 +516,10 @@ def link_anime_altNames(cursor, annId, altName):
     run_sql_command(cursor, sql_link_anime_altName, (annId, altName))
 
 
+temporary_database.unlink(missing_ok=True)
+
 try:
-    sqliteConnection = sqlite3.connect(database)
+    sqliteConnection = sqlite3.connect(temporary_database)
     cursor = sqliteConnection.cursor()
     for command in RESET_DB_SQL.split(";"):
         run_sql_command(cursor, command)
@@ -491,7 +531,7 @@ except sqlite3.Error as error:
     print("\n", error, "\n")
 
 try:
-    sqliteConnection = sqlite3.connect(database)
+    sqliteConnection = sqlite3.connect(temporary_database)
     cursor = sqliteConnection.cursor()
     print("Connection successful :)")
 except sqlite3.Error as error:
@@ -572,7 +612,26 @@ for anime in song_database:
                 link_song_arranger(cursor, song_id, int(arranger[0]))
 
 
+for command in MATERIALIZE_VIEWS_SQL.split(";"):
+    run_sql_command(cursor, command)
+print("Materialization Done :)")
+
+run_sql_command(
+    cursor,
+    "INSERT INTO build_info(key, value) VALUES(?, ?);",
+    ("input_hash", input_hash),
+)
+
 sqliteConnection.commit()
 cursor.close()
 sqliteConnection.close()
 print("Convertion Done :)")
+
+# The snapshot is written first, so the API finds it as soon as it sees the new database
+sql_calls.database_path = temporary_database
+snapshot_file.snapshot_file_path = snapshot_path
+snapshot.build_snapshot_file()
+print("Snapshot Done :)")
+
+os.replace(temporary_database, database)
+print("Database Replaced :)")
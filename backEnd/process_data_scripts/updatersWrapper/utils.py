@@ -1,71 +1,10 @@
 from functools import partial
-import re
-
-ANIME_REGEX_REPLACE_RULES = [
-    {"input": "ź", "replace": "[źŹ]"},
-    {"input": "ļ", "replace": "[ļĻ]"},
-    {"input": "l", "replace": "[l˥ļĻ]"},
-    {"input": "z", "replace": "[zźŹ]"},
-    {"input": "ou", "replace": "(ou|ō|o)"},
-    {"input": "oo", "replace": "(oo|ō|o)"},
-    {"input": "oh", "replace": "(oh|ō|o)"},
-    {"input": "wo", "replace": "(wo|o)"},
-    {"input": "o", "replace": "([oōóòöôøΦο]|ou|oo|oh|wo)"},
-    {"input": "uu", "replace": "(uu|u|ū)"},
-    {"input": "u", "replace": "([uūûúùüǖμ]|uu)"},
-    {"input": "aa", "replace": "(aa|a)"},
-    {"input": "ae", "replace": "(ae|æ)"},
-    {"input": "a", "replace": "([aäά@âàáạåæā∀Λ]|aa)"},
-    {"input": "c", "replace": "[cč]"},
-    {"input": "e", "replace": "[eəéêёëèæē]"},
-    {"input": "'", "replace": "['’ˈ]"},
-    {"input": "n", "replace": "[nñ]"},
-    {"input": "2", "replace": "[2²]"},
-    {"input": "*", "replace": "[*✻＊]"},
-    {
-        "input": " ",
-        "replace": "( ?[²★☆\\/\\*✻＊♣=\\+·♥'ˈ♡∽・±⇔≒〜†×♪→␣:∞;~\\-?,.!@_] ?| )",
-    },
-    {"input": "i", "replace": "([iíίɪ]|ii)"},
-    {"input": "3", "replace": "[3³]"},
-    {"input": "x", "replace": "[x×]"},
-    {"input": "b", "replace": "[bßβ]"},
-    {"input": "r", "replace": "[rЯ]"},
-    {"input": "s", "replace": "[sς]"},
-]
-
-
-def escapeRegExp(str):
-    str = re.escape(str)
-    str = str.replace("\ ", " ")
-    return str
-
-
-def apply_regex_rules(search):
-    for rule in ANIME_REGEX_REPLACE_RULES:
-        search = search.replace(rule["input"], rule["replace"])
-    return search
-
-
-def get_regex_search(og_search, partial_match=True, swap_words=True):
-
-    search = og_search.lower()
-    search = escapeRegExp(search)
-    search = apply_regex_rules(search)
-    search = "^" + search + "$" if not partial_match else ".*" + search + ".*"
-
-    if swap_words:
-        alt_search = og_search.split(" ")
-        if len(alt_search) == 2:
-            alt_search = " ".join([alt_search[1], alt_search[0]])
-            alt_search = apply_regex_rules(alt_search)
-            alt_search = (
-                "^" + alt_search + "$"
-                if not partial_match
-                else ".*" + alt_search + ".*"
-            )
-            search = f"({search})|({alt_search})"
-    return search
+from pathlib import Path
+import sys
+
+# Share the folding used by the API
+sys.path.append(str(Path(__file__).resolve().parents[2] / "app"))
+import folding
 
 
 def ask_validation(message):
@@ -271,26 +210,30 @@ def get_artist_id(
 
         if partial_match:
 
-            artist_regex = get_regex_search(artist)
+            artist_terms = folding.get_search_terms(artist, swap_words=True)
 
             for id in artist_database.keys():
                 flag = False
                 for name in artist_database[id]["names"]:
-                    if re.match(artist_regex, name, re.IGNORECASE):
-                        flag = True
+                    for folded_name in folding.get_folded_forms(name):
+                        if folding.match(folded_name, artist_terms):
+                            flag = True
                 if flag:
                     ids.append(id)
 
         if not partial_match or (ids and len(ids) > 10):
             if partial_match:
                 print("Too much results, removing partial match")
-            artist_regex = get_regex_search(artist, partial_match=False)
+            artist_terms = folding.get_search_terms(artist, swap_words=True)
             ids = []
             for id in artist_database.keys():
                 flag = False
                 for name in artist_database[id]["names"]:
-                    if re.match(artist_regex, name, re.IGNORECASE):
-                        flag = True
+                    for folded_name in folding.get_folded_forms(name):
+                        if folding.match(
+                            folded_name, artist_terms, partial_match=False
+                        ):
+                            flag = True
                 if flag:
                     ids.append(id)
 